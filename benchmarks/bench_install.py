@@ -0,0 +1,103 @@
+"""
+Times ``install()`` against a small fake buildout, as it runs on every
+buildout startup whether or not anything protected is downloaded. The first
+call is timed on its own as it also pays for the imports ``install()``
+defers. For comparison it also times constructing every fetcher in
+``fetch-order``, which is what ``install()`` used to do up front.
+
+    python benchmarks/bench_install.py
+"""
+
+import os
+import shutil
+import tempfile
+import timeit
+import urllib
+import urllib2
+
+from setuptools import package_index
+
+from isotoma.buildout import basicauth
+from isotoma.buildout.basicauth.credentials import Credentials
+
+RUNS = 200
+
+PYPIRC = """\
+[distutils]
+index-servers =
+%(servers)s
+
+%(sections)s
+"""
+
+
+class Section(dict):
+
+    def get_bool(self, key):
+        return self[key].strip().lower() in ('yes', 'true', 'on', '1')
+
+    def get_list(self, key):
+        return [v.strip() for v in self[key].splitlines() if v.strip()]
+
+
+class Buildout(dict):
+
+    def __init__(self):
+        dict.__init__(self)
+        self._raw = {}
+        self['buildout'] = Section({'protected-extensions': ''})
+        self['basicauth'] = Section({
+            'fetch-order': 'lovely\nbuildout\npypi',
+            'interactive': 'no',
+            })
+
+
+def write_pypirc(home, count=50):
+    servers = "\n".join(["    server%d" % i for i in range(count)])
+    sections = "\n".join([
+        "[server%d]\nrepository = https://mirror%d.example.com/simple/\nusername = user%d\npassword = password\n" % (i, i, i)
+        for i in range(count)])
+    fp = open(os.path.join(home, ".pypirc"), "w")
+    fp.write(PYPIRC % {'servers': servers, 'sections': sections})
+    fp.close()
+
+
+def run_install():
+    saved = package_index.open_with_auth, urllib.urlretrieve, urllib2._opener
+    try:
+        basicauth.install(Buildout())
+    finally:
+        package_index.open_with_auth, urllib.urlretrieve, urllib2._opener = saved
+
+
+def run_eager():
+    buildout = Buildout()
+    fetchers = buildout['basicauth'].get_list('fetch-order')
+    credentials = Credentials(buildout, fetchers, interactive=False)
+    credentials.fetchers
+
+
+def main():
+    home = tempfile.mkdtemp()
+    saved_home = os.environ.get('HOME')
+    os.environ['HOME'] = home
+    try:
+        write_pypirc(home)
+        t_first = timeit.Timer(run_install).timeit(1)
+        t_install = timeit.Timer(run_install).timeit(RUNS)
+        t_eager = timeit.Timer(run_eager).timeit(RUNS)
+    finally:
+        if saved_home is None:
+            del os.environ['HOME']
+        else:
+            os.environ['HOME'] = saved_home
+        shutil.rmtree(home)
+
+    print "%-32s %10s" % ("", "ms per run")
+    print "%-32s %10.3f" % ("first install()", t_first * 1e3)
+    print "%-32s %10.3f" % ("install()", t_install / RUNS * 1e3)
+    print "%-32s %10.3f" % ("constructing every fetcher", t_eager / RUNS * 1e3)
+
+
+if __name__ == "__main__":
+    main()
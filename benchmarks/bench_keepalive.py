@@ -0,0 +1,113 @@
+"""
+Fetches the same set of pages from a local HTTPS server with urllib2's
+default opener, which makes a new connection for every request, and with
+KeepAliveHandler, which reuses them.
+
+    python benchmarks/bench_keepalive.py [requests]
+
+Needs the ``openssl`` command to make a throwaway certificate.
+"""
+
+import os
+import ssl
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import subprocess
+import urllib2
+import BaseHTTPServer
+import SocketServer
+
+from isotoma.buildout.basicauth.connection import KeepAliveHandler
+
+BODY = "<html><body>%s</body></html>" % ("<a href='pkg-1.0.tar.gz'>pkg</a>\n" * 200)
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    # Send each response in one go rather than a packet per header line
+    wbufsize = -1
+
+    def do_GET(self):
+        self.server.connections.add(self.client_address)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients dropping idle keep-alive connections isn't interesting
+        pass
+
+
+def make_certificate(directory):
+    cert = os.path.join(directory, "cert.pem")
+    key = os.path.join(directory, "key.pem")
+    subprocess.check_call([
+        "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+        "-subj", "/CN=127.0.0.1", "-keyout", key, "-out", cert,
+        ], stdout=open(os.devnull, "w"), stderr=subprocess.STDOUT)
+    return cert, key
+
+
+def start_server(cert, key):
+    server = Server(("127.0.0.1", 0), Handler)
+    server.connections = set()
+    server.socket = ssl.wrap_socket(server.socket, certfile=cert, keyfile=key, server_side=True)
+    t = threading.Thread(target=server.serve_forever)
+    t.setDaemon(True)
+    t.start()
+    return server
+
+
+def run(opener, url, requests):
+    start = time.time()
+    for i in range(requests):
+        opener.open("%s/simple/pkg%d/" % (url, i)).read()
+    return time.time() - start
+
+
+def main():
+    requests = 200
+    if len(sys.argv) > 1:
+        requests = int(sys.argv[1])
+
+    # The stand-in server has a self signed certificate
+    if hasattr(ssl, "_create_unverified_context"):
+        ssl._create_default_https_context = ssl._create_unverified_context
+
+    tmp = tempfile.mkdtemp()
+    try:
+        cert, key = make_certificate(tmp)
+        server = start_server(cert, key)
+        url = "https://127.0.0.1:%d" % server.server_address[1]
+
+        print "%-12s %10s %12s %10s" % ("opener", "seconds", "requests/s", "conns")
+        keepalive = KeepAliveHandler()
+        for name, opener in (
+                ("urllib2", urllib2.build_opener()),
+                ("keep-alive", urllib2.build_opener(keepalive))):
+            server.connections.clear()
+            elapsed = run(opener, url, requests)
+            print "%-12s %10.3f %12.1f %10d" % (name, elapsed, requests / elapsed, len(server.connections))
+
+        keepalive.pool.close()
+        server.shutdown()
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Counts keyring backend calls over a simulated 500 url build, with and
+without KeyringFetcher remembering what it has read.
+
+Two repositories on the same host need different credentials, and only one
+of them is in the keyring. Every url in the other repository falls back to
+the keyring after the remembered credentials fail.
+
+    python benchmarks/bench_keyring.py
+"""
+
+import time
+import random
+
+from isotoma.buildout.basicauth import fetchers
+from isotoma.buildout.basicauth.credentials import Credentials
+
+URLS = 500
+LATENCY = 0.001
+
+KEYRING = {
+    "https://raw.example.com/": "andy:|penguin55",
+    "https://pypi.example.com/": "john:|sjis",
+    }
+
+# The credentials each directory actually accepts
+ACCEPTS = {
+    "https://raw.example.com/isotoma/foo/": ("andy", "penguin55"),
+    "https://raw.example.com/isotoma/bar/": ("fred", "wilma"),
+    "https://pypi.example.com/simple/": ("john", "sjis"),
+    }
+
+
+class Backend(object):
+
+    """Stands in for python-keyring, counting calls and adding latency"""
+
+    class PasswordSetError(Exception):
+        pass
+
+    def __init__(self):
+        self.calls = 0
+        self.core = self
+        self.backend = self
+
+    def load_keyring(self, *args):
+        return None
+
+    def set_keyring(self, backend):
+        pass
+
+    def get_password(self, service, realm):
+        self.calls += 1
+        time.sleep(LATENCY)
+        return KEYRING.get(realm, None)
+
+    def set_password(self, service, realm, pw):
+        self.calls += 1
+        time.sleep(LATENCY)
+
+
+def urls():
+    r = random.Random(0)
+    prefixes = sorted(ACCEPTS.keys())
+    return ["%spkg%d.tar.gz" % (r.choice(prefixes), i) for i in range(URLS)]
+
+
+def fetch(credentials, url):
+    prefix = credentials.get_prefix(url)
+    realm = credentials.get_realm(url)
+    claimed = credentials.claim(realm)
+    try:
+        for username, password, cache in credentials.search(url):
+            if ACCEPTS[prefix] == (username, password):
+                credentials.success(url, username, password, cache)
+                return True
+    finally:
+        if claimed:
+            credentials.release(realm)
+    credentials.failure(url)
+    return False
+
+
+def build(memoize):
+    backend = Backend()
+    fetchers.keyring = backend
+    credentials = Credentials(None, ["keyring"], interactive=False, deny_ttl=0)
+    keyring = credentials.fetchers[0]
+
+    start = time.time()
+    for url in urls():
+        if not memoize:
+            keyring.memo.clear()
+        fetch(credentials, url)
+    keyring.flush()
+    return backend.calls, time.time() - start
+
+
+def main():
+    print "%-12s %14s %10s" % ("", "backend calls", "seconds")
+    for label, memoize in (("uncached", False), ("memoized", True)):
+        calls, elapsed = build(memoize)
+        print "%-12s %14d %10.3f" % (label, calls, elapsed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""
+Compares credential lookups through PrefixIndex with the linear
+``uri.startswith`` scan the fetchers used to do, for growing numbers of
+configured uris. PrefixIndex lookups should cost the same whatever the size.
+
+    python benchmarks/bench_prefixindex.py
+"""
+
+import timeit
+
+from isotoma.buildout.basicauth.prefixindex import PrefixIndex
+
+SIZES = (10, 100, 1000, 10000)
+LOOKUPS = 10000
+URI = "https://mirror%d.example.com/simple/isotoma.buildout.basicauth/isotoma.buildout.basicauth-0.0.8.tar.gz"
+
+
+def entries(size):
+    return [("https://mirror%d.example.com/simple/" % i, ("user%d" % i, "password")) for i in range(size)]
+
+
+def linear(creds, uri):
+    return [(u, p) for prefix, (u, p) in creds if uri.startswith(prefix)]
+
+
+def main():
+    print "%8s %14s %14s" % ("entries", "linear (us)", "trie (us)")
+    for size in SIZES:
+        creds = entries(size)
+        index = PrefixIndex(creds)
+        uri = URI % (size / 2)
+        assert linear(creds, uri) == index.search(uri)
+
+        t_linear = timeit.Timer(lambda: linear(creds, uri)).timeit(LOOKUPS)
+        t_trie = timeit.Timer(lambda: index.search(uri)).timeit(LOOKUPS)
+        print "%8d %14.2f %14.2f" % (size, t_linear / LOOKUPS * 1e6, t_trie / LOOKUPS * 1e6)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+"""
+Measures the whole download path against local stand-ins for an
+authenticated package index.
+
+Several threaded HTTP servers are started, each a separate realm with its
+own Basic auth credentials, serving a synthetic simple index and an archive
+for every package. Each scenario then fetches every index page through
+``package_index.open_with_auth`` and every archive through
+``urllib.urlretrieve``, either wrapped directly with ``inject_credentials``
+and ``inject_urlretrieve_credentials`` or patched by ``install()`` with a
+given set of options.
+
+Every scenario runs in a fresh interpreter so that its peak RSS is its own.
+For each one the suite reports wall time, requests per second, round-trips
+per artifact (counting 401s) and peak RSS. The results are compared with
+those stored by a previous ``--save``, so regressions in buffering, retries
+or credential search show up.
+
+    python benchmarks/bench_suite.py [--packages N] [--https] [--save]
+
+``--https`` needs the ``openssl`` command to make a throwaway certificate.
+"""
+
+import os
+import sys
+import ssl
+import json
+import time
+import base64
+import shutil
+import hashlib
+import logging
+import optparse
+import resource
+import tempfile
+import threading
+import subprocess
+import urllib
+import BaseHTTPServer
+import SocketServer
+
+RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results", "bench_suite.json")
+
+REALMS = (
+    ("andy", "penguin55"),
+    ("john", "sjis"),
+    ("fred", "wilma"),
+    )
+
+ARCHIVE = "\x1f\x8b" + "basicauth" * 4096
+
+SCENARIOS = (
+    ("adaptors", {}),
+    ("install", {}),
+    ("install-fast", {
+        "keep-alive": "yes",
+        "auth-header": "yes",
+        "stream": "yes",
+        }),
+    )
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    # Send each response in one go rather than a packet per header line
+    wbufsize = -1
+
+    # Bodies are still flushed in 8k pieces, and with Nagle on the last one
+    # waits for the client's delayed ACK on a kept alive connection. Real
+    # index servers turn it off too.
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.server.count(self.path)
+        if self.headers.get("Authorization") != self.server.auth:
+            self.send_body(401, "text/html", "Unauthorized", [("WWW-Authenticate", 'Basic realm="bench"')])
+            return
+
+        path = self.path.split("#", 1)[0]
+        parts = [p for p in path.split("/") if p]
+        if parts == ["simple"]:
+            links = ["<a href='/simple/%s/'>%s</a>" % (p, p) for p in self.server.packages]
+            self.send_body(200, "text/html", "<html><body>%s</body></html>" % "\n".join(links))
+        elif len(parts) == 2 and parts[0] == "simple" and parts[1] in self.server.packages:
+            self.send_body(200, "text/html", "<html><body><a href='/packages/%s-1.0.tar.gz#md5=%s'>%s-1.0.tar.gz</a></body></html>" % (
+                parts[1], hashlib.md5(ARCHIVE).hexdigest(), parts[1]))
+        elif len(parts) == 2 and parts[0] == "packages":
+            self.send_body(200, "application/x-gzip", ARCHIVE)
+        else:
+            self.send_body(404, "text/html", "Not found")
+
+    def send_body(self, code, content_type, body, headers=()):
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, username, password, packages):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0), Handler)
+        self.auth = "Basic %s" % base64.b64encode("%s:%s" % (username, password))
+        self.packages = packages
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def count(self, path):
+        self.lock.acquire()
+        try:
+            self.requests += 1
+        finally:
+            self.lock.release()
+
+    def shutdown_request(self, request):
+        # urllib reads to the end of the connection, and newer OpenSSLs
+        # refuse to count it as the end without a TLS close_notify
+        if hasattr(request, "unwrap"):
+            try:
+                request = request.unwrap()
+            except (ssl.SSLError, IOError):
+                pass
+        BaseHTTPServer.HTTPServer.shutdown_request(self, request)
+
+    def handle_error(self, request, client_address):
+        # Clients dropping idle keep-alive connections isn't interesting
+        pass
+
+
+def make_certificate(directory):
+    cert = os.path.join(directory, "cert.pem")
+    key = os.path.join(directory, "key.pem")
+    subprocess.check_call([
+        "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+        "-subj", "/CN=127.0.0.1", "-keyout", key, "-out", cert,
+        ], stdout=open(os.devnull, "w"), stderr=subprocess.STDOUT)
+    return cert, key
+
+
+def start_servers(packages, certificate=None):
+    """Starts one server per realm, splitting ``packages`` between them"""
+    servers = []
+    for i, (username, password) in enumerate(REALMS):
+        server = Server(username, password, ["pkg%d" % p for p in range(i, packages, len(REALMS))])
+        server.scheme = "http"
+        if certificate:
+            server.socket = ssl.wrap_socket(server.socket, certfile=certificate[0], keyfile=certificate[1], server_side=True)
+            server.scheme = "https"
+        server.url = "%s://127.0.0.1:%d/" % (server.scheme, server.server_address[1])
+        t = threading.Thread(target=server.serve_forever, args=(0.05, ))
+        t.setDaemon(True)
+        t.start()
+        servers.append(server)
+    return servers
+
+
+class Section(dict):
+
+    def get_bool(self, key):
+        return self[key].strip().lower() in ('yes', 'true', 'on', '1')
+
+    def get_list(self, key):
+        return [v.strip() for v in self[key].splitlines() if v.strip()]
+
+
+class Buildout(dict):
+
+    """Just enough of a buildout for install() and the buildout fetcher"""
+
+    def __init__(self, servers, options):
+        dict.__init__(self)
+        self._raw = {}
+        self['buildout'] = Section({'protected-extensions': ''})
+        self['basicauth'] = Section({
+            'fetch-order': 'buildout',
+            'interactive': 'no',
+            'credentials': '\n'.join(["realm%d" % i for i in range(len(servers))]),
+            })
+        self['basicauth'].update(options)
+        for i, server in enumerate(servers):
+            username, password = REALMS[i]
+            self["realm%d" % i] = Section({'uri': server.url, 'username': username, 'password': password})
+
+
+def run_scenario(name, options, servers):
+    """Fetches every index page and archive. Returns the number of artifacts."""
+    from setuptools import package_index
+
+    buildout = Buildout(servers, options)
+    if name == "adaptors":
+        from isotoma.buildout.basicauth.credentials import Credentials
+        from isotoma.buildout.basicauth.download import inject_credentials, inject_urlretrieve_credentials
+        credentials = Credentials(buildout, fetchers=["buildout"], interactive=False)
+        open_with_auth = inject_credentials(credentials)(package_index.open_with_auth)
+        urlretrieve = inject_urlretrieve_credentials(credentials)(urllib.urlretrieve)
+    else:
+        from isotoma.buildout import basicauth
+        basicauth.install(buildout)
+        open_with_auth = package_index.open_with_auth
+        urlretrieve = urllib.urlretrieve
+
+    tmp = tempfile.mkdtemp()
+    artifacts = 0
+    try:
+        for server in servers:
+            open_with_auth(server.url + "simple/").read()
+            for package in server.packages:
+                page = open_with_auth("%ssimple/%s/" % (server.url, package)).read()
+                href = page.split("href='", 1)[1].split("'", 1)[0]
+                filename = os.path.join(tmp, "%s-1.0.tar.gz" % package)
+                urlretrieve(server.url + href.lstrip("/"), filename)
+                artifacts += 1
+    finally:
+        shutil.rmtree(tmp)
+    return artifacts
+
+
+def child(name, packages, https):
+    """Runs a single scenario and prints its results as JSON"""
+    logging.basicConfig(level=logging.WARNING)
+
+    # The stand-in servers have self signed certificates
+    if hasattr(ssl, "_create_unverified_context"):
+        ssl._create_default_https_context = ssl._create_unverified_context
+
+    tmp = tempfile.mkdtemp()
+    try:
+        certificate = None
+        if https:
+            certificate = make_certificate(tmp)
+        servers = start_servers(packages, certificate)
+
+        start = time.time()
+        artifacts = run_scenario(name, dict(SCENARIOS)[name], servers)
+        elapsed = time.time() - start
+
+        requests = sum([s.requests for s in servers])
+        for server in servers:
+            server.shutdown()
+    finally:
+        shutil.rmtree(tmp)
+
+    print json.dumps({
+        "seconds": elapsed,
+        "requests_per_second": requests / elapsed,
+        "round_trips_per_artifact": float(requests) / artifacts,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        })
+
+
+def change(new, old):
+    if not old:
+        return ""
+    return "%+.0f%%" % ((new - old) / float(old) * 100)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("--packages", type="int", default=300)
+    parser.add_option("--https", action="store_true", default=False)
+    parser.add_option("--save", action="store_true", default=False, help="Store these results to compare later runs with")
+    parser.add_option("--scenario", help=optparse.SUPPRESS_HELP)
+    opts, args = parser.parse_args()
+
+    if opts.scenario:
+        child(opts.scenario, opts.packages, opts.https)
+        return
+
+    key = "%s-%d" % (opts.https and "https" or "http", opts.packages)
+    stored = {}
+    if os.path.exists(RESULTS):
+        stored = json.load(open(RESULTS))
+
+    results = {}
+    print "%-14s %9s %7s %11s %7s %13s %7s %10s %7s" % (
+        "scenario", "seconds", "", "requests/s", "", "trips/artifact", "", "peak RSS kb", "")
+    for name, options in SCENARIOS:
+        cmd = [sys.executable, __file__, "--scenario", name, "--packages", str(opts.packages)]
+        if opts.https:
+            cmd.append("--https")
+        out = subprocess.Popen(cmd, stdout=subprocess.PIPE).communicate()[0]
+        result = results[name] = json.loads(out.strip().splitlines()[-1])
+
+        old = stored.get(key, {}).get(name, {})
+        print "%-14s %9.3f %7s %11.1f %7s %14.2f %7s %10d %7s" % (
+            name,
+            result["seconds"], change(result["seconds"], old.get("seconds")),
+            result["requests_per_second"], change(result["requests_per_second"], old.get("requests_per_second")),
+            result["round_trips_per_artifact"], change(result["round_trips_per_artifact"], old.get("round_trips_per_artifact")),
+            result["peak_rss_kb"], change(result["peak_rss_kb"], old.get("peak_rss_kb")),
+            )
+
+    if opts.save:
+        stored[key] = results
+        if not os.path.exists(os.path.dirname(RESULTS)):
+            os.makedirs(os.path.dirname(RESULTS))
+        fp = open(RESULTS, "w")
+        json.dump(stored, fp, indent=2, sort_keys=True)
+        fp.close()
+        print "Saved to %s" % RESULTS
+
+
+if __name__ == "__main__":
+    main()
@@ -3,36 +3,136 @@
 
 import logging
 
-from setuptools import package_index
-
-import urllib
-from zc.buildout import UserError
-
-import missingbits
-from isotoma.buildout.basicauth.credentials import Credentials
-from isotoma.buildout.basicauth.protected_ext import load_protected_extensions
-from isotoma.buildout.basicauth.download import inject_credentials, inject_urlretrieve_credentials
-
 logger = logging.getLogger('isotoma.buildout.basicauth')
 
 def install(buildout):
+    # Everything else is imported here rather than at module level, as
+    # buildout imports every extension on startup, even when running offline
+    from setuptools import package_index
+    import atexit
+    import urllib
+    import urllib2
+
+    import missingbits
+    from isotoma.buildout.basicauth.credentials import Credentials
+    from isotoma.buildout.basicauth.metrics import Metrics
+    from isotoma.buildout.basicauth.realmcache import RealmCache
+    from isotoma.buildout.basicauth.snapshot import Snapshot
+    from isotoma.buildout.basicauth.retry import RetryPolicy, CircuitBreaker
+    from isotoma.buildout.basicauth.connection import KeepAliveHandler, make_urlretrieve
+    from isotoma.buildout.basicauth.httpcache import HTTPCache, CacheHandler
+    from isotoma.buildout.basicauth.store import ContentStore
+    from isotoma.buildout.basicauth.protected_ext import load_protected_extensions
+    from isotoma.buildout.basicauth.download import inject_credentials, inject_urlretrieve_credentials, AuthHeaderHandler
+
     buildout._raw.setdefault('basicauth', {})
     basicauth = buildout['basicauth']
     basicauth.setdefault('interactive', 'yes')
     basicauth.setdefault('fetch-order', '\n'.join(("lovely", "buildout", "pypi", "prompt")))
+    basicauth.setdefault('stream', 'no')
+    basicauth.setdefault('preemptive', 'yes')
+    basicauth.setdefault('realm-cache', '')
+    basicauth.setdefault('negative-cache-ttl', '0')
+    basicauth.setdefault('retry-attempts', '3')
+    basicauth.setdefault('retry-base-delay', '1')
+    basicauth.setdefault('retry-max-delay', '30')
+    basicauth.setdefault('circuit-threshold', '5')
+    basicauth.setdefault('circuit-cooldown', '60')
+    basicauth.setdefault('keep-alive', 'no')
+    basicauth.setdefault('auth-header', 'no')
+    basicauth.setdefault('index-cache', '')
+    basicauth.setdefault('resume', 'no')
+    basicauth.setdefault('download-store', '')
+    basicauth.setdefault('metrics', 'no')
+    basicauth.setdefault('metrics-report', '')
+    basicauth.setdefault('snapshot', '')
+    basicauth.setdefault('snapshot-write', 'no')
+
+    metrics = Metrics()
+    if basicauth.get_bool('metrics'):
+        atexit.register(metrics.log_summary)
+    if basicauth['metrics-report'].strip():
+        atexit.register(metrics.write, basicauth['metrics-report'].strip())
+
+    cache = None
+    if basicauth['realm-cache'].strip():
+        cache = RealmCache(basicauth['realm-cache'].strip())
 
     credentials = Credentials(
         buildout,
         fetchers = basicauth.get_list("fetch-order"),
         interactive = basicauth.get_bool("interactive"),
+        preemptive = basicauth.get_bool("preemptive"),
+        cache = cache,
+        deny_ttl = float(basicauth['negative-cache-ttl']),
+        metrics = metrics,
+        )
+
+    if basicauth['snapshot'].strip():
+        snapshot = Snapshot(basicauth['snapshot'].strip())
+        if basicauth.get_bool('snapshot-write'):
+            atexit.register(snapshot.save, credentials)
+        else:
+            # Everything in the snapshot is known before the first download
+            credentials.urls.update(snapshot.credentials())
+
+    policy = RetryPolicy(
+        attempts = int(basicauth['retry-attempts']),
+        base_delay = float(basicauth['retry-base-delay']),
+        max_delay = float(basicauth['retry-max-delay']),
+        )
+
+    breaker = CircuitBreaker(
+        threshold = int(basicauth['circuit-threshold']),
+        cooldown = float(basicauth['circuit-cooldown']),
         )
 
+    handlers = []
+    if basicauth.get_bool('keep-alive'):
+        handlers.append(KeepAliveHandler())
+
+    auth_handler = None
+    if basicauth.get_bool('auth-header'):
+        auth_handler = AuthHeaderHandler()
+        handlers.append(auth_handler)
+
+    if basicauth['index-cache'].strip():
+        handlers.append(CacheHandler(HTTPCache(basicauth['index-cache'].strip())))
+
+    if handlers:
+        logger.info('Installing urllib2 handlers for http auth support')
+        urllib2.install_opener(urllib2.build_opener(*handlers))
+
+    urlretrieve = urllib.urlretrieve
+    if handlers or basicauth.get_bool('resume'):
+        urlretrieve = make_urlretrieve(urllib.urlretrieve, resume=basicauth.get_bool('resume'))
+
+    store = None
+    if basicauth['download-store'].strip():
+        store = ContentStore(basicauth['download-store'].strip())
+
     # Monkeypatch distribute
     logger.info('Monkeypatching distribute to add http auth support')
-    package_index.open_with_auth = inject_credentials(credentials)(package_index.open_with_auth)
+    package_index.open_with_auth = inject_credentials(
+        credentials,
+        stream = basicauth.get_bool("stream"),
+        policy = policy,
+        breaker = breaker,
+        global_opener = bool(handlers),
+        auth_handler = auth_handler,
+        store = store,
+        metrics = metrics,
+        )(package_index.open_with_auth)
 
     logger.info('Monkeypatching urllib.urlretrieve to add http auth support')
-    urllib.urlretrieve = inject_urlretrieve_credentials(credentials)(urllib.urlretrieve)
+    urllib.urlretrieve = inject_urlretrieve_credentials(
+        credentials,
+        policy = policy,
+        breaker = breaker,
+        auth_handler = auth_handler,
+        store = store,
+        metrics = metrics,
+        )(urlretrieve)
 
     # Load the buildout:protected-extensions now that we have basicauth
-    load_protected_extensions(buildout)
+    load_protected_extensions(buildout, credentials)
@@ -0,0 +1,80 @@
+"""
+Downloads many urls at once for recipes and tools that need a lot of files
+from protected hosts, instead of fetching them one after another.
+
+Each url goes through ``urllib.urlretrieve``, which is the credential aware
+``UrlRetrieveAdaptor`` once ``install()`` has run, so credentials are
+searched for and remembered exactly as they are for a single download. The
+first thread to reach a realm resolves its credentials while the others
+wait for it.
+"""
+
+import threading
+import urllib
+import urlparse
+
+from isotoma.buildout.basicauth import threadpool
+from isotoma.buildout.basicauth.download import strip_auth
+
+
+def get_host(url):
+    pr = urlparse.urlparse(strip_auth(url))
+    return urlparse.urlunparse((pr[0], pr[1], '/', '', '', ''))
+
+
+class BatchFetcher(object):
+
+    """
+    Fetches urls on up to ``workers`` threads, with no more than
+    ``per_host`` requests to any one host at a time.
+    """
+
+    def __init__(self, retrieve=None, workers=8, per_host=4):
+        self.retrieve = retrieve
+        self.workers = workers
+        self.per_host = per_host
+        self.limits = {}
+        self.lock = threading.Lock()
+
+    def get_limit(self, url):
+        host = get_host(url)
+        self.lock.acquire()
+        try:
+            if not host in self.limits:
+                self.limits[host] = threading.Semaphore(self.per_host)
+            return self.limits[host]
+        finally:
+            self.lock.release()
+
+    def fetch(self, item):
+        if isinstance(item, basestring):
+            url, filename = item, None
+        else:
+            url, filename = item
+
+        # Looked up on each call so that it is the patched one if install()
+        # runs after we are created
+        retrieve = self.retrieve or urllib.urlretrieve
+
+        limit = self.get_limit(url)
+        limit.acquire()
+        try:
+            return retrieve(url, filename)
+        finally:
+            limit.release()
+
+    def fetch_many(self, urls):
+        """
+        Fetches ``urls``, each of which is either a url or a ``(url,
+        filename)`` pair. Blocks until they are all done.
+
+        Returns a list of ``(success, value)`` pairs in the same order as
+        ``urls``, where value is either the ``(filename, headers)`` returned
+        by ``urlretrieve`` or the exception it raised.
+        """
+        return threadpool.run(self.fetch, urls, self.workers)
+
+
+def fetch_many(urls, workers=8, per_host=4):
+    """Fetches ``urls`` concurrently through ``urllib.urlretrieve``. See ``BatchFetcher.fetch_many``."""
+    return BatchFetcher(workers=workers, per_host=per_host).fetch_many(urls)
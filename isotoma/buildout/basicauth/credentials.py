@@ -1,54 +1,294 @@
+import time
 import logging
+import threading
 from urlparse import urlparse, urlunparse
 from zc.buildout import UserError
 from isotoma.buildout.basicauth.fetchers import Fetcher
+from isotoma.buildout.basicauth.metrics import Metrics
 
 logger = logging.getLogger(__name__)
 
 class Credentials(object):
+    """
+    Searches the configured fetchers for credentials and remembers which ones
+    worked for each realm.
 
-    def __init__(self, buildout, fetchers, interactive=True):
+    Credentials that worked are remembered against the directory of the url
+    they worked for, as well as against the realm if nothing is known for it
+    yet. A later url is first tried with whatever worked for its closest
+    parent directory, so a host that serves several repositories under
+    different credentials only has to search once per repository.
+
+    It is safe to share between threads. Only one thread at a time resolves
+    a realm that hasn't been seen yet; any other thread that needs the same
+    realm waits for it and then starts from the credentials it found, so a
+    new realm is only probed, looked up in the keyring or prompted for once.
+    Searches are bracketed by ``claim()`` and ``release()`` to arrange this.
+
+    Fetchers are only constructed when a search first reaches them, so a
+    buildout that never downloads anything protected never reads .pypirc or
+    loads a keyring backend. Preemptive credentials only construct the
+    fetchers that read uris from configuration.
+
+    Once every fetcher has failed for a url, its realm is remembered as
+    unauthenticated for ``deny_ttl`` seconds. Until then urls in it are only
+    tried with credentials that already worked for a parent directory, and
+    without credentials, so public paths on the same host still work. The
+    default ``deny_ttl`` of 0 turns this off.
+    """
+
+    def __init__(self, buildout, fetchers, interactive=True, preemptive=True, cache=None,
+                 deny_ttl=0, clock=time.time, metrics=None):
         self.urls = {}
+        self.denied = set()
+        self.unauthenticated = {}
+        self.deny_ttl = deny_ttl
+        self.clock = clock
+        self.metrics = metrics or Metrics()
+        self.preemptive = preemptive
+        self.protected = None
+        self.sources = {}
+        self.cache = cache
+        self.lock = threading.RLock()
+        self.resolved = threading.Condition(self.lock)
+        self.resolving = {}
         self.buildout = buildout
         self.interactive = interactive
-        self.fetchers = []
+        self.fetcher_classes = []
+        self._fetchers = {}
         [self.add_fetcher(f) for f in fetchers]
 
     def add_fetcher(self, fetchername):
         for f in Fetcher.__subclasses__():
             if f.name == fetchername:
-                self.fetchers.append(f(self))
+                self.fetcher_classes.append(f)
                 return
         raise UserError("No fetcher '%s'" % fetchername)
 
+    def get_fetcher(self, cls):
+        """Returns the instance of fetcher class cls, constructing it if needed"""
+        self.lock.acquire()
+        try:
+            if not cls in self._fetchers:
+                logger.debug("Loading '%s' fetcher" % cls.name)
+                start = self.metrics.clock()
+                try:
+                    self._fetchers[cls] = cls(self)
+                finally:
+                    self.metrics.fetcher_loaded(cls.name, self.metrics.clock() - start)
+            return self._fetchers[cls]
+        finally:
+            self.lock.release()
+
+    def get_all_fetchers(self):
+        return [self.get_fetcher(cls) for cls in self.fetcher_classes]
+
+    fetchers = property(get_all_fetchers)
+
+    def get_loaded_fetchers(self):
+        """Returns the fetchers that have been constructed so far, in search order"""
+        return [self._fetchers[cls] for cls in self.fetcher_classes if cls in self._fetchers]
+
+    def get_protected(self):
+        """
+        Returns the uri prefixes the fetchers know need credentials, by
+        realm. They are gathered from the fetchers that read them from
+        configuration the first time they are needed.
+        """
+        self.lock.acquire()
+        try:
+            if self.protected is None:
+                self.protected = {}
+                if self.preemptive:
+                    for cls in self.fetcher_classes:
+                        if cls.preemptive:
+                            self.add_protected(self.get_fetcher(cls))
+            return self.protected
+        finally:
+            self.lock.release()
+
+    def add_protected(self, fetcher):
+        for uri in fetcher.protected():
+            self.protected.setdefault(self.get_realm(uri), []).append(uri)
+
+    def is_protected(self, url):
+        for uri in self.get_protected().get(self.get_realm(url), []):
+            if url.startswith(uri):
+                return True
+        return False
+
     def get_realm(self, url):
         pr = urlparse(url)
         return urlunparse((pr[0], pr[1], '/', '', '', ''))
 
+    def get_prefix(self, url):
+        """The directory ``url`` is in, e.g. ``http://host/a/`` for ``http://host/a/b.tgz``"""
+        pr = urlparse(url)
+        path = pr[2][:pr[2].rfind('/') + 1] or '/'
+        return urlunparse((pr[0], pr[1], path, '', '', ''))
+
+    def lookup(self, url):
+        """
+        Returns the credentials that worked for the closest parent directory
+        of ``url``, or None. Costs one dict lookup per path segment.
+        """
+        realm = self.get_realm(url)
+        prefix = self.get_prefix(url)
+        while True:
+            if prefix in self.urls:
+                return self.urls[prefix]
+            if len(prefix) <= len(realm):
+                return None
+            prefix = prefix[:prefix.rstrip('/').rfind('/') + 1]
+
+    def get_fetchers(self, realm):
+        """
+        Returns the fetcher classes in the order they should be searched,
+        starting with the one that worked for this realm on a previous run.
+        """
+        if self.cache is None:
+            return self.fetcher_classes
+
+        name = self.cache.get(realm)
+        first = [f for f in self.fetcher_classes if f.name == name]
+        return first + [f for f in self.fetcher_classes if f.name != name]
+
+    def claim(self, realm):
+        """
+        Returns True if the calling thread should resolve ``realm``, after
+        waiting for any other thread that is already resolving it.
+        """
+        me = threading.currentThread()
+        self.lock.acquire()
+        try:
+            while self.resolving.get(realm, me) is not me:
+                self.resolved.wait()
+            if realm in self.urls or realm in self.resolving:
+                return False
+            self.resolving[realm] = me
+            return True
+        finally:
+            self.lock.release()
+
+    def release(self, realm):
+        """Wakes up any threads waiting for ``realm`` to be resolved"""
+        self.lock.acquire()
+        try:
+            if self.resolving.get(realm, None) is threading.currentThread():
+                del self.resolving[realm]
+                self.resolved.notifyAll()
+        finally:
+            self.lock.release()
+
+    def is_unauthenticated(self, url):
+        """True if every fetcher failed in the realm of ``url`` within the last ``deny_ttl`` seconds"""
+        realm = self.get_realm(url)
+        self.lock.acquire()
+        try:
+            expires = self.unauthenticated.get(realm, None)
+            if expires is None:
+                return False
+            if expires <= self.clock():
+                del self.unauthenticated[realm]
+                return False
+            return True
+        finally:
+            self.lock.release()
+
     def search(self, url):
+        """
+        Yields ``(username, password, cache)`` for each set of credentials to
+        try for ``url``. Callers should ``claim()`` the realm first and
+        ``release()`` it once they are done, so that other threads wait for
+        the result rather than searching too.
+        """
         realm = self.get_realm(url)
-        if realm in self.urls:
+        cached = self.lookup(url)
+        if self.is_unauthenticated(url):
+            logger.debug("No credentials worked for %s recently - not searching for more" % realm)
+            if cached is not None and cached[0] is not None:
+                yield cached[0], cached[1], False
+            yield None, None, False
+            return
+
+        anonymous = False
+        if cached is not None:
             logger.debug("Using previously successful credentials")
-            username, password = self.urls[realm]
+            username, password = cached
             # We say this password can't be cached because it already was cached
             # During a plone buildout that would make us write to the keyring
             # 200 times!!
             yield username, password, False
+        elif self.is_protected(url):
+            logger.debug("First time seeing this URL but it is known to need credentials")
+            anonymous = True
+        elif self.cache is not None and self.cache.get(realm):
+            logger.debug("First time seeing this URL but credentials came from '%s' last time" % self.cache.get(realm))
+            anonymous = True
         else:
             logger.debug("First time seeing this URL - trying with no credentials")
             # We say this password can't be cached because we don't want to
             # send None, None to backends
             yield None, None, False
 
-        for f in self.fetchers:
-            logger.debug("Searching '%s' for credentials" % f.name)
-            for cred in f.search(url, realm):
-                yield cred
+        for cls in self.get_fetchers(realm):
+            logger.debug("Searching '%s' for credentials" % cls.name)
+            f = self.get_fetcher(cls)
+            for username, password, cache in self.timed_search(f, url, realm):
+                self.sources[(realm, username, password)] = f.name
+                yield username, password, cache
+
+        if anonymous:
+            logger.debug("No credentials found - trying with no credentials")
+            yield None, None, False
+
+    def timed_search(self, fetcher, url, realm):
+        """
+        Searches ``fetcher``, recording the time spent in it and the number
+        of results it returned with the metrics
+        """
+        results = iter(fetcher.search(url, realm))
+        while True:
+            start = self.metrics.clock()
+            found = 0
+            try:
+                cred = results.next()
+                found = 1
+            finally:
+                self.metrics.fetcher(fetcher.name, self.metrics.clock() - start, found)
+            yield cred
 
     def success(self, url, username, password, cache):
         realm = self.get_realm(url)
-        self.urls[realm] = (username, password)
-        if cache:
-            for f in self.fetchers:
-                f.success(realm, username, password)
+        self.lock.acquire()
+        try:
+            self.urls[self.get_prefix(url)] = (username, password)
+            self.urls.setdefault(realm, (username, password))
+            source = self.sources.get((realm, username, password), None)
+            if self.cache is not None and source:
+                self.cache.set(realm, source)
+            if cache:
+                for f in self.get_loaded_fetchers():
+                    f.success(realm, username, password)
+            self.release(realm)
+        finally:
+            self.lock.release()
 
+    def failure(self, url):
+        """Called when no credentials could be found that work for url"""
+        realm = self.get_realm(url)
+        self.lock.acquire()
+        try:
+            self.denied.add(url)
+            if not self.deny_ttl or self.is_unauthenticated(url):
+                return
+            # A directory that credentials have worked for is left alone, as
+            # it is more likely this one url is refused to everybody. Pages
+            # that loaded without credentials don't count.
+            cached = self.lookup(url)
+            if cached is not None and cached[0] is not None:
+                return
+            logger.warning("No credentials found for %s, not trying again for %d seconds" % (realm, self.deny_ttl))
+            self.unauthenticated[realm] = self.clock() + self.deny_ttl
+        finally:
+            self.lock.release()
@@ -4,15 +4,21 @@ monkeypatch zc.buildout.download with a custom 401 handler, and add a custom
 handler to urllib2.opener.handlers.
 """
 
+import os
 import logging
+import tempfile
+import mimetools
 import urllib
 import urllib2
 import urlparse
 import base64
-import time
+import threading
 from zc.buildout import UserError
 import StringIO
 
+from isotoma.buildout.basicauth.retry import RetryPolicy, CircuitBreaker, get_status
+from isotoma.buildout.basicauth.metrics import Metrics
+
 logger = logging.getLogger(__name__)
 
 def strip_auth(url):
@@ -39,39 +45,120 @@ def _inject_credentials(url, username=None, password=None):
     return url
 
 
+class AuthHeaderHandler(urllib2.BaseHandler):
+
+    """
+    Sends the credentials an AuthAdaptor is currently trying as an
+    ``Authorization`` header, so the URL itself doesn't change and caches
+    keyed on it still work.
+
+    The credentials being tried are kept per thread, and are only sent to
+    the realm they were chosen for.
+    """
+
+    def __init__(self):
+        self.headers = {}
+        self.local = threading.local()
+
+    def get_header(self, username, password):
+        key = (username, password)
+        if not key in self.headers:
+            self.headers[key] = 'Basic %s' % base64.b64encode('%s:%s' % key)
+        return self.headers[key]
+
+    def set_credentials(self, realm, username, password):
+        if username and password:
+            self.local.current = (realm, self.get_header(username, password))
+        else:
+            self.local.current = None
+
+    def http_request(self, req):
+        current = getattr(self.local, 'current', None)
+        if current:
+            realm, header = current
+            scheme, netloc = urlparse.urlparse(strip_auth(req.get_full_url()))[:2]
+            if realm == urlparse.urlunparse((scheme, netloc, '/', '', '', '')):
+                req.add_unredirected_header('Authorization', header)
+        return req
+
+    https_request = http_request
+
+
 class AuthError(Exception):
-    pass
+
+    def __init__(self, code=401):
+        Exception.__init__(self, code)
+        self.code = code
+
 
 class NotFoundError(Exception):
     pass
 
 class AuthAdaptor(object):
 
-    ATTEMPTS = 3
-
-    def __init__(self, credentials):
+    def __init__(self, credentials, policy=None, breaker=None, auth_handler=None, store=None, metrics=None):
         self.credentials = credentials
+        self.policy = policy or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker(threshold=0)
+        self.auth_handler = auth_handler
+        self.store = store
+        self.metrics = metrics or Metrics()
 
     def call(self, *args, **kwargs):
         raise NotImplementedError(self.call)
 
-    def attempt(self, *args, **kwargs):
-        for i in range(self.ATTEMPTS):
+    def size(self, res):
+        """The number of bytes in a result returned by call(), if known"""
+        return 0
+
+    def attempt(self, url, *args, **kwargs):
+        realm = self.credentials.get_realm(strip_auth(url))
+        for i in range(self.policy.attempts):
+            if not self.breaker.allow(realm):
+                self.unavailable()
+            start = self.metrics.clock()
             try:
-                return self.call(*args, **kwargs)
-            except AuthError:
+                try:
+                    res = self.call(url, *args, **kwargs)
+                finally:
+                    elapsed = self.metrics.clock() - start
+            except AuthError, e:
+                # The host answered, so it isn't down
+                self.metrics.request(realm, elapsed)
+                self.metrics.status(realm, e.code)
+                self.breaker.success(realm)
                 raise
             except NotFoundError:
+                self.metrics.request(realm, elapsed)
+                self.metrics.status(realm, 404)
+                self.breaker.success(realm)
                 raise
             except Exception, e:
-                logger.exception("Attempt to access resource failed. Will try again in %d seconds" % i)
-                time.sleep(i)
+                self.metrics.request(realm, elapsed)
+                retryable = self.policy.retryable(e)
+                if retryable:
+                    self.breaker.failure(realm)
+                if i == self.policy.attempts - 1 or not retryable:
+                    logger.exception("Attempt to access resource failed")
+                    break
+                delay = self.policy.delay(i, e)
+                logger.exception("Attempt to access resource failed. Will try again in %.1f seconds" % delay)
+                self.metrics.retry(realm, delay)
+                self.policy.sleep(delay)
+            else:
+                self.metrics.request(realm, elapsed, self.size(res))
+                self.breaker.success(realm)
+                return res
 
         self.broken()
 
     def broken(self):
         raise UserError("Despite multiple attempts buildout was unable to access a remote resource")
 
+    def unavailable(self):
+        """Called instead of trying a host that has failed too often lately"""
+        self.broken()
+
     def forbidden(self):
         raise UserError("Forbidden")
 
@@ -81,24 +168,98 @@ class AuthAdaptor(object):
     def __call__(self, url, *args, **kwargs):
         logger.debug('Downloading URL %s' % strip_auth(url))
 
-        for username, password, cache in self.credentials.search(url):
-            new_url = _inject_credentials(url, username, password)
-            try:
-                res = self.attempt(new_url, *args, **kwargs)
+        realm = self.credentials.get_realm(strip_auth(url))
+        if not self.breaker.allow(realm):
+            self.unavailable()
 
-            except AuthError, e:
-                logger.debug('Could not authenticate %s.' % (url, ))
+        # Searched outside the try as python 2.4 can't yield inside a
+        # try/finally, and a generator can't release the realm itself
+        claimed = self.credentials.claim(realm)
+        try:
+            for username, password, cache in self.credentials.search(url):
+                if self.auth_handler:
+                    self.auth_handler.set_credentials(realm, username, password)
+                    new_url = url
+                else:
+                    new_url = _inject_credentials(url, username, password)
+                try:
+                    res = self.attempt(new_url, *args, **kwargs)
 
-            except NotFoundError, e:
-                self.not_found()
+                except AuthError, e:
+                    logger.debug('Could not authenticate %s.' % (url, ))
 
-            else:
-                self.credentials.success(url, username, password, cache)
-                return res
+                except NotFoundError, e:
+                    self.not_found()
 
+                else:
+                    self.credentials.success(url, username, password, cache)
+                    return res
+        finally:
+            if self.auth_handler:
+                self.auth_handler.set_credentials(realm, None, None)
+            # Let other threads waiting on this realm carry on straight away
+            if claimed:
+                self.credentials.release(realm)
+
+        self.credentials.failure(url)
         self.forbidden()
 
 
+class StreamingFile(object):
+
+    """
+    Wraps a response body so that it is read from the socket lazily.
+
+    Only the first ``peek`` bytes are read up front, which is enough to know
+    the body has started arriving while we are still inside the retry loop.
+    """
+
+    def __init__(self, fp, peek=8192):
+        self.fp = fp
+        self.head = fp.read(peek)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data = self.head + self.fp.read()
+            self.head = ''
+            return data
+        if self.head:
+            data = self.head[:size]
+            self.head = self.head[size:]
+            return data
+        return self.fp.read(size)
+
+    def readline(self, size=-1):
+        if self.head:
+            idx = self.head.find('\n')
+            if idx >= 0:
+                if size is None or size < 0 or size > idx:
+                    size = idx + 1
+                data = self.head[:size]
+                self.head = self.head[size:]
+                return data
+            data = self.head
+            self.head = ''
+            return data + self.fp.readline()
+        return self.fp.readline()
+
+    def readlines(self, sizehint=0):
+        return list(self)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def close(self):
+        self.head = ''
+        self.fp.close()
+
+
 class addinfourl(urllib2.addinfourl):
 
     """ Support Python 2.4 and 2.6 """
@@ -111,48 +272,118 @@ class addinfourl(urllib2.addinfourl):
             self.code = code
 
 
-def inject_credentials(credentials):
+def stored_headers(path):
+    """Headers to go with a file served from a ContentStore"""
+    return mimetools.Message(StringIO.StringIO(
+        "Content-Length: %d\n\n" % os.path.getsize(path)))
+
+
+def inject_credentials(credentials, stream=False, policy=None, breaker=None, global_opener=False, auth_handler=None, store=None, metrics=None):
     def decorator(auth_func):
         class DistributeAdaptor(AuthAdaptor):
+
+            PEEK_SIZE = 8192
+
+            def __init__(self, credentials, stream=False, policy=None, breaker=None, global_opener=False, auth_handler=None, store=None, metrics=None):
+                super(DistributeAdaptor, self).__init__(credentials, policy, breaker, auth_handler, store, metrics)
+                self.stream = stream
+                self.global_opener = global_opener
+
+            def __call__(self, url, *args, **kwargs):
+                # The store only holds files under a verified checksum from
+                # the url, so serving them without credentials gives nothing
+                # away that the url didn't already pin down
+                if self.store:
+                    fp = self.store.open(url)
+                    if fp is not None:
+                        return addinfourl(fp, stored_headers(fp.name), url, 200)
+                return super(DistributeAdaptor, self).__call__(url, *args, **kwargs)
+
             def not_found(self):
                 raise urllib2.HTTPError('', 404, "Not found", {}, StringIO.StringIO(""))
 
+            def size(self, res):
+                try:
+                    return int(res.info().get('Content-Length', 0))
+                except (AttributeError, ValueError):
+                    return 0
+
+            def unavailable(self):
+                # setuptools treats this as a failed link and moves on to
+                # the next one
+                raise urllib2.URLError("Host has failed too often recently")
+
             def call(self, *args, **kwargs):
+                if self.global_opener:
+                    # Newer setuptools passes in an opener of its own. Leave it
+                    # out so that the request goes through urllib2.urlopen and
+                    # so through the handlers we installed.
+                    args = args[:1]
+                    kwargs.pop('opener', None)
                 try:
                     r = auth_func(*args, **kwargs)
-                    fp = StringIO.StringIO(r.read())
+                    if self.stream:
+                        fp = StreamingFile(r, self.PEEK_SIZE)
+                    else:
+                        fp = StringIO.StringIO(r.read())
+                    if self.store:
+                        fp = self.store.tee(args[0], fp)
                     resp = addinfourl(fp, r.headers, r.url, r.code)
                     return resp
 
                 except Exception, e:
                     code = getattr(e, 'code', 'unknown')
                     if code in (401, 403):
-                        raise AuthError
+                        raise AuthError(code)
                     elif code == 404:
                         raise NotFoundError
                     else:
                         raise
 
-        return DistributeAdaptor(credentials)
+        return DistributeAdaptor(credentials, stream, policy, breaker, global_opener, auth_handler, store, metrics)
     return decorator
 
 
-def inject_urlretrieve_credentials(credentials):
+def inject_urlretrieve_credentials(credentials, policy=None, breaker=None, auth_handler=None, store=None, metrics=None):
     def decorator(auth_func):
         class UrlRetrieveAdaptor(AuthAdaptor):
+
+            def __call__(self, url, filename=None, *args, **kwargs):
+                if not self.store or not self.store.storable(url):
+                    return super(UrlRetrieveAdaptor, self).__call__(url, filename, *args, **kwargs)
+
+                if not filename:
+                    suffix = os.path.splitext(urlparse.urlparse(url)[2])[1]
+                    fd, filename = tempfile.mkstemp(suffix)
+                    os.close(fd)
+
+                if self.store.get(url, filename):
+                    return filename, stored_headers(filename)
+
+                res = super(UrlRetrieveAdaptor, self).__call__(url, filename, *args, **kwargs)
+                self.store.add(url, res[0])
+                return res
+
+            def size(self, res):
+                try:
+                    return os.path.getsize(res[0])
+                except (TypeError, IndexError, OSError):
+                    return 0
+
             def call(self, *args, **kwargs):
                 try:
                     res = auth_func(*args, **kwargs)
                     return res
                 except IOError, e:
-                    code = e.args[1]
+                    # Timeouts while reading the body only have a message
+                    code = get_status(e)
                     if code in (401, 403):
-                        raise AuthError
+                        raise AuthError(code)
                     elif code == 404:
                         raise NotFoundError
                     else: raise
 
-        return UrlRetrieveAdaptor(credentials)
+        return UrlRetrieveAdaptor(credentials, policy, breaker, auth_handler, store, metrics)
     return decorator
 
 
@@ -0,0 +1,119 @@
+"""
+Downloads a chain of ``${buildout:extends}`` configs concurrently.
+
+Buildout fetches extended configs one at a time, and only learns what a
+config extends once it has been downloaded and parsed. Here the graph is
+walked a level at a time instead: every config at one level is fetched at
+once through ``fetch_many``, then they are all parsed to find the next level.
+
+The files end up named the way buildout's own downloader names them in its
+``extends-cache``, so a buildout run afterwards can read the whole chain
+from disk. It is meant to be run before buildout, for example from a
+bootstrap script once ``install()`` has patched ``urlretrieve``. Buildout
+already downloads the chain itself before any extension is loaded, so there
+is nothing to gain from calling it during a run.
+"""
+
+import os
+import logging
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+from isotoma.buildout.basicauth.batch import BatchFetcher
+
+logger = logging.getLogger(__name__)
+
+
+def isurl(name):
+    return '://' in name
+
+
+def get_extends(path):
+    """Returns the configs that the config at ``path`` extends"""
+    fp = open(path)
+    try:
+        try:
+            from zc.buildout.configparser import parse
+        except ImportError:
+            import ConfigParser
+            parser = ConfigParser.RawConfigParser()
+            parser.readfp(fp, path)
+            if not parser.has_option('buildout', 'extends'):
+                return []
+            return parser.get('buildout', 'extends').split()
+        return parse(fp, path).get('buildout', {}).get('extends', '').split()
+    finally:
+        fp.close()
+
+
+def resolve(parent, name):
+    """
+    Where ``name``, from the extends of config ``parent``, is. This follows
+    the rules buildout uses, so that urls come out exactly as buildout
+    would ask for them.
+    """
+    if isurl(name):
+        return name
+    if isurl(parent):
+        if os.path.isabs(name):
+            return name
+        return parent[:parent.rfind('/')] + '/' + name
+    return os.path.join(os.path.dirname(parent), name)
+
+
+def cache_name(url):
+    """The name buildout's downloader gives ``url`` in the extends-cache"""
+    return md5(url).hexdigest()
+
+
+def prefetch_extends(roots, dest, fetcher=None):
+    """
+    Downloads every config that ``roots`` extend, directly or indirectly,
+    into ``dest``. Local configs are read where they are.
+
+    Returns a dict mapping each url that was downloaded to its file.
+    """
+    fetcher = fetcher or BatchFetcher()
+    files = {}
+    seen = set()
+
+    level = list(roots)
+    while level:
+        urls, configs = [], []
+        for name in level:
+            if name in seen:
+                continue
+            seen.add(name)
+            if isurl(name):
+                urls.append(name)
+            else:
+                configs.append((name, name))
+
+        items = [(url, os.path.join(dest, cache_name(url)) + '.tmp') for url in urls]
+        results = []
+        if items:
+            results = fetcher.fetch_many(items)
+        for (url, tmp), (success, value) in zip(items, results):
+            if not success:
+                logger.warning("Could not prefetch %s: %s" % (url, value))
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                continue
+            path = tmp[:-len('.tmp')]
+            os.rename(tmp, path)
+            files[url] = path
+            configs.append((url, path))
+
+        level = []
+        for name, path in configs:
+            if not os.path.exists(path):
+                continue
+            try:
+                level.extend([resolve(name, e) for e in get_extends(path)])
+            except Exception, e:
+                logger.warning("Could not read extends from %s: %s" % (name, e))
+
+    return files
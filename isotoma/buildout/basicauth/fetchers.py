@@ -1,16 +1,64 @@
 import os
+import atexit
 import logging
 import getpass
+import threading
 import urlparse
-import ConfigParser
 
-try:
-    import keyring
-except ImportError:
-    keyring = None
+from isotoma.buildout.basicauth.prefixindex import PrefixIndex
+
+# python-keyring can be very slow to import with some backends, so it is
+# only imported once the keyring fetcher is used. See get_keyring().
+keyring = None
+
+# KeyringFetchers with passwords waiting to be written at exit. See
+# flush_keyrings().
+_queued = []
+_queued_lock = threading.Lock()
+_flush_registered = False
 
 logger = logging.getLogger(__name__)
 
+
+def get_keyring():
+    """Imports python-keyring on first use. Returns None if it isn't installed."""
+    global keyring
+    if keyring is None:
+        try:
+            import keyring as _keyring
+        except ImportError:
+            return None
+        keyring = _keyring
+    return keyring
+
+
+def queue_flush(fetcher):
+    """Arranges for ``fetcher`` to be flushed at exit"""
+    global _flush_registered
+    _queued_lock.acquire()
+    try:
+        if not _flush_registered:
+            atexit.register(flush_keyrings)
+            _flush_registered = True
+        if not fetcher in _queued:
+            _queued.append(fetcher)
+    finally:
+        _queued_lock.release()
+
+
+def flush_keyrings():
+    """Writes the passwords every KeyringFetcher has queued"""
+    _queued_lock.acquire()
+    try:
+        queued = _queued[:]
+        del _queued[:]
+    finally:
+        _queued_lock.release()
+
+    for fetcher in queued:
+        fetcher.flush()
+
+
 class Fetcher(object):
     """
     A class that can fetch http authentication credentials by some method.
@@ -28,6 +76,10 @@ class Fetcher(object):
     then return as many credentials as it could.
     """
 
+    # Whether protected() can list uris from configuration. Only these
+    # fetchers are constructed to find out what to send credentials to up front.
+    preemptive = False
+
     def __init__(self, mgr):
         self.mgr = mgr
 
@@ -38,11 +90,18 @@ class Fetcher(object):
     def search(self, uri, realm):
         raise StopIteration
 
+    def protected(self):
+        """The uri prefixes this fetcher knows to need credentials"""
+        return []
+
 
 class PromptFetcher(Fetcher):
 
     name = "prompt"
 
+    # Only one thread may talk to the terminal at a time
+    lock = threading.Lock()
+
     def __init__(self, mgr):
         super(PromptFetcher, self).__init__(mgr)
         self.max_tries = 5
@@ -52,30 +111,41 @@ class PromptFetcher(Fetcher):
             raise StopIteration
 
         for i in range(self.max_tries):
-            username = raw_input('Username for %s: ' % realm)
-            password = getpass.getpass('Password for %s: ' % realm)
+            self.lock.acquire()
+            try:
+                username = raw_input('Username for %s: ' % realm)
+                password = getpass.getpass('Password for %s: ' % realm)
+            finally:
+                self.lock.release()
             yield (username, password, True)
 
 
 class PyPiRCFetcher(Fetcher):
 
     name = "pypi"
+    preemptive = True
     PYPIRC_LOC = '~/.pypirc'
 
     def __init__(self, mgr):
         super(PyPiRCFetcher, self).__init__(mgr)
         self.pypirc_loc = os.path.expanduser(self.PYPIRC_LOC)
         self.config = self._get_pypirc_credentials()
+        self.index = PrefixIndex(
+            [(uri, (username, password)) for uri, username, password in self.config])
 
     def search(self, uri, realm):
-        for realm, username, password in self.config:
-            if uri.startswith(realm):
-                yield username, password, True
+        for username, password in self.index.search(uri):
+            yield username, password, True
+
+    def protected(self):
+        return [uri for uri, username, password in self.config]
 
     def _get_pypirc_credentials(self):
         if not os.path.exists(self.pypirc_loc):
             return []
 
+        import ConfigParser
+
         config = []
 
         c = ConfigParser.ConfigParser()
@@ -113,6 +183,7 @@ class PyPiRCFetcher(Fetcher):
 class LovelyFetcher(Fetcher):
 
     name = "lovely"
+    preemptive = True
 
     def search(self, uri, realm):
         lovely = self.mgr.buildout.get("lovely.buildouthttp", {})
@@ -123,15 +194,22 @@ class LovelyFetcher(Fetcher):
             if username and password:
                 yield username, password, True
 
+    def protected(self):
+        lovely = self.mgr.buildout.get("lovely.buildouthttp", {})
+        if lovely.get("uri", None) and lovely.get("username", None) and lovely.get("password", None):
+            return [lovely["uri"]]
+        return []
+
 
 class BuildoutFetcher(Fetcher):
 
     name = "buildout"
-
+    preemptive = True
 
     def __init__(self, mgr):
         super(BuildoutFetcher, self).__init__(mgr)
         self.creds = []
+        self.index = PrefixIndex()
 
         if not "basicauth" in self.mgr.buildout:
             return
@@ -141,40 +219,90 @@ class BuildoutFetcher(Fetcher):
             for partname in basicauth.get_list("credentials"):
                 part = self.mgr.buildout[partname]
                 self.creds.append((part["uri"], part["username"], part["password"]))
+                self.index.add(part["uri"], (part["username"], part["password"]))
 
 
     def search(self, uri, realm):
-        for repo_uri, username, password in self.creds:
-            if uri.startswith(repo_uri):
-                yield username, password, True
+        for username, password in self.index.search(uri):
+            yield username, password, True
 
+    def protected(self):
+        return [uri for uri, username, password in self.creds]
 
-if keyring:
 
-    class KeyringFetcher(Fetcher):
-        """
-        Uses python-keyring to securely fetch passwords from your keyring, if they
-        exist. Degrades gracefully if the specified keyring doesn't exist.
-        """
+class KeyringFetcher(Fetcher):
+    """
+    Uses python-keyring to securely fetch passwords from your keyring, if they
+    exist. Degrades gracefully if the specified keyring doesn't exist, or if
+    python-keyring isn't installed.
+
+    Keyring backends can be slow to write to, so passwords that worked are
+    queued and written in one go, once per realm, when buildout exits. Reads
+    are remembered for the rest of the run, so each realm is only looked up
+    in the keyring once.
+    """
 
-        name = "keyring"
-        SERVICE = 'isotoma.buildout.basicauth'
-        SEP = ':|'
+    name = "keyring"
+    SERVICE = 'isotoma.buildout.basicauth'
+    SEP = ':|'
 
-        def __init__(self, mgr):
-           super(KeyringFetcher, self).__init__(mgr)
-           backend = keyring.core.load_keyring(None, 'keyring.backend.%s' % "GnomeKeyring")
-           keyring.set_keyring(backend)
+    def __init__(self, mgr):
+        super(KeyringFetcher, self).__init__(mgr)
+        self.pending = {}
+        self.memo = {}
+        self.lock = threading.Lock()
+        self.keyring = get_keyring()
+        if self.keyring is None:
+            logger.warning('python-keyring is not installed, not using the keyring')
+            return
+        backend = self.keyring.core.load_keyring(None, 'keyring.backend.%s' % "GnomeKeyring")
+        self.keyring.set_keyring(backend)
 
-        def success(self, uri, username, password):
-            pw = self.SEP.join((username, password))
+    def success(self, uri, username, password):
+        if self.keyring is None:
+            return
+        self.lock.acquire()
+        try:
+            self.pending[uri] = self.SEP.join((username, password))
+            self.memo[uri] = self.pending[uri]
+        finally:
+            self.lock.release()
+        queue_flush(self)
+
+    def flush(self):
+        """Writes any queued passwords to the keyring"""
+        self.lock.acquire()
+        try:
+            pending, self.pending = self.pending, {}
+        finally:
+            self.lock.release()
+
+        for uri, pw in sorted(pending.items()):
             try:
-                keyring.set_password(self.SERVICE, uri, pw)
-            except keyring.backend.PasswordSetError:
+                self.keyring.set_password(self.SERVICE, uri, pw)
+            except self.keyring.backend.PasswordSetError:
                 logger.warning('Could not set password in keyring')
 
-        def search(self, uri, realm):
-            pw = keyring.get_password(self.SERVICE, realm)
-            if pw:
-                username, password = pw.split(self.SEP)
-                yield username, password, True
+    def get_password(self, realm):
+        self.lock.acquire()
+        try:
+            if realm in self.memo:
+                return self.memo[realm]
+        finally:
+            self.lock.release()
+
+        pw = self.keyring.get_password(self.SERVICE, realm)
+
+        self.lock.acquire()
+        try:
+            return self.memo.setdefault(realm, pw)
+        finally:
+            self.lock.release()
+
+    def search(self, uri, realm):
+        if self.keyring is None:
+            raise StopIteration
+        pw = self.get_password(realm)
+        if pw:
+            username, password = pw.split(self.SEP)
+            yield username, password, True
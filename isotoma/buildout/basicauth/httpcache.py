@@ -0,0 +1,168 @@
+"""
+An on-disk cache of index pages, revalidated with conditional GETs.
+
+Simple-index and find-links pages rarely change between buildout runs, so
+rather than downloading them every time we keep a copy along with its
+``ETag`` and ``Last-Modified`` headers. The next request for the page sends
+``If-None-Match`` and ``If-Modified-Since``, and if the server answers 304 the
+stored copy is used.
+
+Pages are filed by realm and username, so a page fetched with one user's
+credentials is never handed back for a request made with someone else's.
+"""
+
+import os
+import base64
+import logging
+import urllib
+import urllib2
+import urlparse
+import mimetools
+import StringIO
+
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1
+
+from isotoma.buildout.basicauth.download import strip_auth
+
+logger = logging.getLogger(__name__)
+
+
+class HTTPCache(object):
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, partition, url):
+        return os.path.join(
+            self.directory,
+            sha1(partition).hexdigest(),
+            sha1(url).hexdigest(),
+            )
+
+    def get(self, partition, url):
+        """Returns the stored ``(headers, body)`` for url, or None"""
+        path = self.path(partition, url)
+        if not os.path.exists(path):
+            return None
+
+        fp = open(path, 'rb')
+        try:
+            headers = mimetools.Message(fp)
+            body = fp.read()
+        finally:
+            fp.close()
+        return headers, body
+
+    def put(self, partition, url, headers, body):
+        path = self.path(partition, url)
+        directory = os.path.dirname(path)
+        tmp = "%s.%d" % (path, os.getpid())
+        try:
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            fp = open(tmp, 'wb')
+            try:
+                fp.write(''.join(headers.headers))
+                fp.write('\r\n')
+                fp.write(body)
+            finally:
+                fp.close()
+            os.rename(tmp, path)
+        except (IOError, OSError), e:
+            logger.warning("Could not cache '%s': %s" % (url, e))
+
+
+class CacheHandler(urllib2.BaseHandler):
+
+    """
+    Adds validators to requests for pages in an HTTPCache, serves the stored
+    page when the server says it hasn't changed, and stores HTML pages that
+    come back with validators.
+    """
+
+    # Run after anything that adds an Authorization header
+    handler_order = 600
+
+    CACHEABLE_TYPES = ('text/html', )
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def get_key(self, req):
+        """The partition and url a request is filed under"""
+        url = req.get_full_url()
+        scheme, netloc = urlparse.urlparse(url)[:2]
+        userinfo, host = urllib.splituser(netloc)
+
+        username = ''
+        auth = req.get_header('Authorization', None)
+        if auth and auth.lower().startswith('basic '):
+            try:
+                username = base64.b64decode(auth[6:].strip()).split(':', 1)[0]
+            except TypeError:
+                pass
+        elif userinfo:
+            username = urllib.unquote(urllib.splitpasswd(userinfo)[0])
+
+        partition = '%s://%s/\n%s' % (scheme, host, username)
+        return partition, strip_auth(url)
+
+    def http_request(self, req):
+        if req.get_method() != 'GET':
+            return req
+
+        partition, url = self.get_key(req)
+        entry = self.cache.get(partition, url)
+        if entry is None:
+            return req
+
+        headers, body = entry
+        if headers.get('ETag'):
+            req.add_unredirected_header('If-None-Match', headers['ETag'])
+        if headers.get('Last-Modified'):
+            req.add_unredirected_header('If-Modified-Since', headers['Last-Modified'])
+        return req
+
+    def http_response(self, req, response):
+        if req.get_method() != 'GET' or response.code != 200:
+            return response
+
+        headers = response.info()
+        if not headers.get('ETag') and not headers.get('Last-Modified'):
+            return response
+        if headers.gettype() not in self.CACHEABLE_TYPES:
+            return response
+
+        body = response.read()
+        response.close()
+
+        partition, url = self.get_key(req)
+        self.cache.put(partition, url, headers, body)
+
+        resp = urllib.addinfourl(StringIO.StringIO(body), headers, response.geturl())
+        resp.code = response.code
+        resp.msg = response.msg
+        return resp
+
+    def http_error_304(self, req, fp, code, msg, hdrs):
+        partition, url = self.get_key(req)
+        entry = self.cache.get(partition, url)
+        if entry is None:
+            return None
+
+        logger.debug("Using cached copy of %s" % url)
+        # Reading to the end hands a kept alive connection back to the pool,
+        # where closing it first would drop it
+        fp.read()
+        fp.close()
+        headers, body = entry
+        resp = urllib.addinfourl(StringIO.StringIO(body), headers, req.get_full_url())
+        resp.code = 200
+        resp.msg = 'OK'
+        return resp
+
+    https_request = http_request
+    https_response = http_response
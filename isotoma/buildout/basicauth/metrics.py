@@ -0,0 +1,152 @@
+"""
+Counts and times what basicauth does during a run, by realm: requests,
+bytes, latency, refused and missing urls, and retries, along with the time
+spent searching each fetcher for credentials. The totals can be logged as a
+table at the end of the run, or written out as JSON to compare between runs.
+"""
+
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds, in seconds, of the latency histogram buckets
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Metrics(object):
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.realms = {}
+        self.fetchers = {}
+        self.lock = threading.Lock()
+
+    def _realm(self, realm):
+        if not realm in self.realms:
+            self.realms[realm] = {
+                'requests': 0,
+                'bytes': 0,
+                'seconds': 0.0,
+                'max_seconds': 0.0,
+                'latency': [0] * (len(BUCKETS) + 1),
+                'status': {},
+                'retries': 0,
+                'retry_sleep': 0.0,
+                }
+        return self.realms[realm]
+
+    def request(self, realm, seconds, size=0):
+        """Records a request to ``realm`` that took ``seconds`` and returned ``size`` bytes"""
+        self.lock.acquire()
+        try:
+            stats = self._realm(realm)
+            stats['requests'] += 1
+            stats['bytes'] += size
+            stats['seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+            bucket = len(BUCKETS)
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    bucket = i
+                    break
+            stats['latency'][bucket] += 1
+        finally:
+            self.lock.release()
+
+    def status(self, realm, code):
+        """Records a 401, 403 or 404 from ``realm``"""
+        self.lock.acquire()
+        try:
+            status = self._realm(realm)['status']
+            status[code] = status.get(code, 0) + 1
+        finally:
+            self.lock.release()
+
+    def retry(self, realm, delay):
+        self.lock.acquire()
+        try:
+            stats = self._realm(realm)
+            stats['retries'] += 1
+            stats['retry_sleep'] += delay
+        finally:
+            self.lock.release()
+
+    def _fetcher(self, name):
+        if not name in self.fetchers:
+            self.fetchers[name] = {'calls': 0, 'seconds': 0.0, 'load_seconds': 0.0}
+        return self.fetchers[name]
+
+    def fetcher(self, name, seconds, calls=1):
+        """
+        Records ``seconds`` spent searching the fetcher called ``name``, and
+        ``calls`` results it returned
+        """
+        self.lock.acquire()
+        try:
+            stats = self._fetcher(name)
+            stats['calls'] += calls
+            stats['seconds'] += seconds
+        finally:
+            self.lock.release()
+
+    def fetcher_loaded(self, name, seconds):
+        """Records ``seconds`` spent constructing the fetcher called ``name``"""
+        self.lock.acquire()
+        try:
+            self._fetcher(name)['load_seconds'] += seconds
+        finally:
+            self.lock.release()
+
+    def report(self):
+        """Everything recorded so far, as a dict that can be dumped as JSON"""
+        self.lock.acquire()
+        try:
+            realms = {}
+            for realm, stats in self.realms.items():
+                stats = dict(stats)
+                stats['status'] = dict([(str(code), count) for code, count in stats['status'].items()])
+                stats['latency'] = dict(zip([str(b) for b in BUCKETS] + ['inf'], stats['latency']))
+                realms[realm] = stats
+            fetchers = dict([(name, dict(stats)) for name, stats in self.fetchers.items()])
+        finally:
+            self.lock.release()
+        return {'realms': realms, 'fetchers': fetchers}
+
+    def summary(self):
+        """Returns a table of everything recorded so far, as a list of lines"""
+        report = self.report()
+        lines = ["%-40s %8s %10s %8s %8s %5s %5s %5s %7s %8s" % (
+            "realm", "requests", "bytes", "mean ms", "max ms", "401", "403", "404", "retries", "sleep s")]
+        for realm, stats in sorted(report['realms'].items()):
+            mean = 0.0
+            if stats['requests']:
+                mean = stats['seconds'] / stats['requests']
+            lines.append("%-40s %8d %10d %8.1f %8.1f %5d %5d %5d %7d %8.1f" % (
+                realm, stats['requests'], stats['bytes'], mean * 1000, stats['max_seconds'] * 1000,
+                stats['status'].get('401', 0), stats['status'].get('403', 0), stats['status'].get('404', 0),
+                stats['retries'], stats['retry_sleep']))
+
+        if report['fetchers']:
+            lines.append("")
+            lines.append("%-40s %8s %10s %10s" % ("fetcher", "calls", "seconds", "load s"))
+            for name, stats in sorted(report['fetchers'].items()):
+                lines.append("%-40s %8d %10.3f %10.3f" % (name, stats['calls'], stats['seconds'], stats['load_seconds']))
+        return lines
+
+    def log_summary(self):
+        for line in self.summary():
+            logger.info(line)
+
+    def write(self, path):
+        """Writes the report to ``path`` as JSON"""
+        import json
+        try:
+            fp = open(path, 'w')
+            try:
+                json.dump(self.report(), fp, indent=2, sort_keys=True)
+            finally:
+                fp.close()
+        except IOError, e:
+            logger.warning("Could not write metrics to '%s': %s" % (path, e))
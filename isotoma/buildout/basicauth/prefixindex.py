@@ -0,0 +1,47 @@
+class PrefixIndex(object):
+    """
+    Maps uri prefixes to values, and finds the values for every prefix of a
+    given uri, most specific first.
+
+    A value matches a uri exactly when ``uri.startswith(prefix)`` would be
+    true. Each prefix is split on '/' and all but the last segment become
+    nodes in a trie. The last segment may be partial (``http://host/sim``) so
+    it is stored in a dictionary on its parent node and matched by looking up
+    each leading slice of the corresponding uri segment. The cost of a lookup
+    depends on the length of the uri, not on how many prefixes are indexed.
+    """
+
+    def __init__(self, entries=()):
+        self.root = ({}, {})
+        for prefix, value in entries:
+            self.add(prefix, value)
+
+    def add(self, prefix, value):
+        parts = prefix.split('/')
+        children, tails = self.root
+        for part in parts[:-1]:
+            if not part in children:
+                children[part] = ({}, {})
+            children, tails = children[part]
+        tails.setdefault(parts[-1], []).append(value)
+
+    def search(self, uri):
+        found = []
+        children, tails = self.root
+        for part in uri.split('/'):
+            matches = []
+            if tails:
+                for i in range(len(part), -1, -1):
+                    if part[:i] in tails:
+                        matches.extend(tails[part[:i]])
+            found.append(matches)
+
+            if not part in children:
+                break
+            children, tails = children[part]
+
+        found.reverse()
+        results = []
+        for matches in found:
+            results.extend(matches)
+        return results
@@ -1,8 +1,93 @@
 import os
+import shutil
+import logging
+import tempfile
 import pkg_resources
 from zc.buildout import easy_install
 
-def load_protected_extensions(buildout=None):
+from isotoma.buildout.basicauth import threadpool
+
+logger = logging.getLogger(__name__)
+
+def prefetch(specs, dest, links, index, workers, allow_hosts=('*',)):
+    """
+    Downloads the distributions for ``specs`` into ``dest`` using a pool of
+    ``workers`` threads, so that the final install can pick them up from
+    disk rather than fetching them one after another.
+
+    The first spec is fetched on its own. That usually settles the
+    credentials for the index every other spec comes from, so the pool
+    doesn't have several threads asking for the same password at once.
+    """
+    from setuptools.package_index import PackageIndex
+
+    def fetch(spec):
+        if index:
+            pi = PackageIndex(index, hosts=allow_hosts)
+        else:
+            pi = PackageIndex(hosts=allow_hosts)
+        pi.add_find_links(links)
+        return pi.fetch_distribution(pkg_resources.Requirement.parse(spec), dest)
+
+    results = threadpool.run(fetch, specs[:1], 1)
+    results.extend(threadpool.run(fetch, specs[1:], workers))
+
+    for spec, (success, value) in zip(specs, results):
+        if not success:
+            logger.warning("Could not prefetch %s: %s" % (spec, value))
+
+
+def needs_fetch(specs, path, newest=True):
+    """
+    Returns the specs in ``specs`` that installing would download. A spec is
+    left out if the running buildout already has it, or if a distribution in
+    ``path`` satisfies it and either ``newest`` is off or the spec pins that
+    exact version.
+    """
+    environment = pkg_resources.Environment(path)
+    missing = []
+    for spec in specs:
+        req = pkg_resources.Requirement.parse(spec)
+        try:
+            if pkg_resources.working_set.find(req) is not None:
+                continue
+        except pkg_resources.VersionConflict:
+            pass
+
+        local = [dist for dist in environment[req.key] if dist in req]
+        pinned = [op for op, version in req.specs if op == '==']
+        if local and (not newest or pinned):
+            continue
+        missing.append(spec)
+    return missing
+
+
+def index_urls():
+    """Returns the urls the package indexes zc.buildout has cached have read"""
+    urls = set()
+    for index in getattr(easy_install, '_indexes', {}).values():
+        urls.update(index.fetched_urls.keys())
+    return urls
+
+
+def forget_urls(urls):
+    """
+    Removes ``urls`` from the package indexes zc.buildout has cached, so that
+    they are fetched again the next time they are needed. Everything else
+    the indexes have already read is kept.
+    """
+    indexes = getattr(easy_install, '_indexes', None)
+    if indexes is None:
+        easy_install.clear_index_cache()
+        return
+
+    for index in indexes.values():
+        for url in urls:
+            index.scanned_urls.pop(url, None)
+            index.fetched_urls.pop(url, None)
+
+
+def load_protected_extensions(buildout=None, credentials=None):
     """
     Because all of the extensions are loaded prior to any of them being
     applied, we have added a protected-extensions option::
@@ -14,12 +99,25 @@ def load_protected_extensions(buildout=None):
 
     Then every protected extension will be loaded once the basicauth extension
     has been applied, meaning they'll be fetched using credentials.
+
+    If ``basicauth:prefetch-workers`` is more than 1, the protected extensions
+    that aren't already installed are downloaded concurrently by that many
+    threads before they are installed.
     """
     if not buildout:
          return
 
     specs = buildout['buildout'].get('protected-extensions', '').split()
     if specs:
+        # Pages read while buildout loaded its extensions were read without
+        # basicauth. Any that were refused never reached our credentials, so
+        # they aren't in credentials.denied.
+        stale = index_urls()
+
+        links = buildout['buildout'].get('find-links', '').split()
+        index = buildout['buildout'].get('index')
+        workers = int(buildout['basicauth'].get('prefetch-workers', '0') or 0)
+
         path = [buildout['buildout']['develop-eggs-directory']]
         if buildout['buildout']['offline'] == 'true':
             dest = None
@@ -27,17 +125,33 @@ def load_protected_extensions(buildout=None):
         else:
             dest = buildout['buildout']['eggs-directory']
             if not os.path.exists(dest):
-                log.info('Creating directory %r.' % dest)
+                logger.info('Creating directory %r.' % dest)
                 os.mkdir(dest)
 
-        easy_install.install(
-            specs, dest, path=path,
-            working_set=pkg_resources.working_set,
-            links = buildout['buildout'].get('find-links', '').split(),
-            index = buildout['buildout'].get('index'),
-            newest=buildout.newest, allow_hosts=buildout._allow_hosts,
-        )   
+        tmp = None
+        if dest and workers > 1 and len(specs) > 1:
+            missing = needs_fetch(specs, path + [dest], buildout.newest)
+            if len(missing) > 1:
+                tmp = tempfile.mkdtemp(prefix='basicauth-')
+                prefetch(missing, tmp, links, index, workers, buildout._allow_hosts)
+                links = [tmp] + links
 
-        # Clear cache because extensions might now let us read pages we
-        # couldn't read before.
-        easy_install.clear_index_cache()
+        try:
+            easy_install.install(
+                specs, dest, path=path,
+                working_set=pkg_resources.working_set,
+                links = links,
+                index = index,
+                newest=buildout.newest, allow_hosts=buildout._allow_hosts,
+            )
+        finally:
+            if tmp:
+                shutil.rmtree(tmp)
+
+        # Extensions might now let us read pages we couldn't read before, so
+        # forget the pages we were refused, and any read without basicauth.
+        if credentials is None:
+            easy_install.clear_index_cache()
+        else:
+            forget_urls(stale | credentials.denied)
+            credentials.denied.clear()
@@ -0,0 +1,58 @@
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+class RealmCache(object):
+    """
+    Remembers which fetcher found working credentials for each realm so that
+    the next buildout run can go straight to it.
+
+    Only the name of the fetcher is stored, never a username or password. The
+    file has one realm per line, followed by the fetcher name::
+
+        https://pypi.example.com/ buildout
+        https://raw.github.com/ keyring
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.realms = self._load()
+
+    def get(self, realm):
+        return self.realms.get(realm, None)
+
+    def set(self, realm, fetchername):
+        if self.realms.get(realm, None) == fetchername:
+            return
+        self.realms[realm] = fetchername
+        self.save()
+
+    def _load(self):
+        realms = {}
+        if not os.path.exists(self.path):
+            return realms
+
+        for line in open(self.path).readlines():
+            parts = line.split()
+            if len(parts) != 2:
+                continue
+            realms[parts[0]] = parts[1]
+        return realms
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        tmp = "%s.%d" % (self.path, os.getpid())
+        try:
+            fp = open(tmp, "w")
+            try:
+                for realm in sorted(self.realms):
+                    fp.write("%s %s\n" % (realm, self.realms[realm]))
+            finally:
+                fp.close()
+            os.rename(tmp, self.path)
+        except (IOError, OSError), e:
+            logger.warning("Could not write realm cache '%s': %s" % (self.path, e))
@@ -0,0 +1,158 @@
+import time
+import random
+import socket
+import logging
+import threading
+import httplib
+import urllib
+import urllib2
+from email import Utils
+
+logger = logging.getLogger(__name__)
+
+
+class _ContentTooShortError(IOError):
+    """Stands in for urllib.ContentTooShortError, which is new in python 2.5"""
+
+    def __init__(self, message, content):
+        IOError.__init__(self, message)
+        self.content = content
+
+ContentTooShortError = getattr(urllib, 'ContentTooShortError', _ContentTooShortError)
+
+
+def get_status(error):
+    """The HTTP status code carried by an exception from urllib or urllib2"""
+    code = getattr(error, 'code', None)
+    if isinstance(code, int):
+        return code
+    args = getattr(error, 'args', ())
+    if len(args) >= 2 and args[0] == 'http error' and isinstance(args[1], int):
+        return args[1]
+    return None
+
+
+def get_headers(error):
+    """The response headers carried by an exception from urllib or urllib2"""
+    headers = getattr(error, 'hdrs', None)
+    if headers is not None:
+        return headers
+    args = getattr(error, 'args', ())
+    if len(args) >= 4 and args[0] == 'http error':
+        return args[3]
+    return None
+
+
+class RetryPolicy(object):
+    """
+    Decides whether a failed attempt to fetch a resource is worth repeating,
+    and how long to wait before doing so.
+
+    The wait before retry ``n`` is picked at random between 0 and
+    ``base_delay * 2 ** n`` seconds, capped at ``max_delay`` ("full jitter"),
+    so that many clients failing at once don't all come back together. A
+    ``Retry-After`` header on a 429 or 503 response is always honoured.
+
+    ``sleep``, ``random`` and ``clock`` can be swapped out for testing.
+    """
+
+    RETRY_CODES = (429, 500, 502, 503, 504)
+    RETRY_AFTER_CODES = (429, 503)
+
+    def __init__(self, attempts=3, base_delay=1.0, max_delay=30.0,
+                 sleep=time.sleep, random=random.random, clock=time.time):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+        self.random = random
+        self.clock = clock
+
+    def retryable(self, error):
+        code = get_status(error)
+        if code is not None:
+            return code in self.RETRY_CODES
+
+        args = getattr(error, 'args', ())
+        if isinstance(error, IOError) and args and args[0] in ('socket error', 'checksum error'):
+            # urllib wraps connection failures up like this, and a download
+            # that arrived corrupted is worth fetching again
+            return True
+
+        return isinstance(error, (socket.error, httplib.HTTPException,
+                                  urllib2.URLError, ContentTooShortError))
+
+    def retry_after(self, error):
+        """The number of seconds a 429 or 503 response asked us to wait"""
+        if get_status(error) not in self.RETRY_AFTER_CODES:
+            return None
+
+        headers = get_headers(error)
+        if headers is None:
+            return None
+
+        value = headers.get('Retry-After', None)
+        if not value:
+            return None
+
+        value = value.strip()
+        if value.isdigit():
+            return float(value)
+
+        date = Utils.parsedate_tz(value)
+        if date is None:
+            return None
+        return max(0.0, Utils.mktime_tz(date) - self.clock())
+
+    def delay(self, attempt, error=None):
+        """How long to wait after failed attempt number ``attempt`` (from 0)"""
+        ceiling = min(self.max_delay, self.base_delay * (2 ** attempt))
+        delay = self.random() * ceiling
+
+        retry_after = self.retry_after(error)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+
+class CircuitBreaker(object):
+    """
+    Keeps count of consecutive transport failures for each realm. Once a
+    realm has failed ``threshold`` times in a row it is considered down, and
+    requests to it fail straight away for ``cooldown`` seconds. After that
+    requests are let through again, but the first failure trips the breaker
+    straight back.
+
+    A ``threshold`` of 0 disables the breaker.
+    """
+
+    def __init__(self, threshold=5, cooldown=60.0, clock=time.time):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self.failures = {}
+        self.tripped = {}
+        self.lock = threading.Lock()
+
+    def allow(self, realm):
+        return self.tripped.get(realm, 0) <= self.clock()
+
+    def failure(self, realm):
+        if not self.threshold:
+            return
+        self.lock.acquire()
+        try:
+            self.failures[realm] = self.failures.get(realm, 0) + 1
+            if self.failures[realm] >= self.threshold:
+                logger.warning("Too many failures talking to %s, not trying again for %d seconds" % (realm, self.cooldown))
+                self.tripped[realm] = self.clock() + self.cooldown
+        finally:
+            self.lock.release()
+
+    def success(self, realm):
+        self.lock.acquire()
+        try:
+            self.failures.pop(realm, None)
+            self.tripped.pop(realm, None)
+        finally:
+            self.lock.release()
@@ -0,0 +1,113 @@
+import os
+import re
+import logging
+from urlparse import urlparse
+
+logger = logging.getLogger(__name__)
+
+class Snapshot(object):
+    """
+    Records which uris needed credentials, and where each set came from, so
+    that a CI run can be handed them all up front instead of searching.
+
+    The file has one uri per line, followed by the fetcher that found the
+    credentials and a reference to where CI should read them from. The
+    reference is never the credentials themselves. It is either a pair of
+    environment variables or a file holding ``username:password``::
+
+        https://pypi.example.com/ keyring env:BASICAUTH_PYPI_EXAMPLE_COM_USERNAME,BASICAUTH_PYPI_EXAMPLE_COM_PASSWORD
+        https://raw.github.com/isotoma/ buildout file:/run/secrets/github
+
+    New uris are given environment variable references. Existing lines are
+    kept as they are when the snapshot is saved again, so references can be
+    edited by hand.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = self._load()
+
+    def get_env_ref(self, uri):
+        pr = urlparse(uri)
+        name = re.sub('[^A-Z0-9]+', '_', (pr[1] + pr[2]).upper()).strip('_')
+        return "env:BASICAUTH_%s_USERNAME,BASICAUTH_%s_PASSWORD" % (name, name)
+
+    def resolve(self, ref):
+        """Returns the ``(username, password)`` that ``ref`` points at, or None"""
+        kind, value = ref.split(':', 1)
+        if kind == 'env':
+            names = value.split(',')
+            if len(names) != 2 or not names[0] in os.environ or not names[1] in os.environ:
+                return None
+            return os.environ[names[0]], os.environ[names[1]]
+        elif kind == 'file':
+            if not os.path.exists(value):
+                return None
+            line = open(value).readline().strip()
+            if not ':' in line:
+                return None
+            return tuple(line.split(':', 1))
+        return None
+
+    def credentials(self):
+        """
+        Returns a dict mapping each uri to its ``(username, password)``, for
+        every uri whose reference can be resolved.
+        """
+        found = {}
+        for uri, (source, ref) in self.entries.items():
+            creds = self.resolve(ref)
+            if creds is None:
+                logger.warning("No credentials for %s at '%s'" % (uri, ref))
+                continue
+            found[uri] = creds
+        return found
+
+    def update(self, credentials):
+        """
+        Adds every uri that ``credentials`` has found credentials for. A uri
+        is left out if the same credentials are recorded for a parent of it,
+        as they are found through the parent anyway.
+        """
+        urls = credentials.urls.items()
+        for uri, (username, password) in urls:
+            if username is None or uri in self.entries:
+                continue
+            covered = [u for u, c in urls if c == (username, password) and len(u) < len(uri) and uri.startswith(u)]
+            if covered:
+                continue
+            realm = credentials.get_realm(uri)
+            source = credentials.sources.get((realm, username, password), None) or 'unknown'
+            self.entries[uri] = (source, self.get_env_ref(uri))
+
+    def _load(self):
+        entries = {}
+        if not os.path.exists(self.path):
+            return entries
+
+        for line in open(self.path).readlines():
+            parts = line.split()
+            if len(parts) != 3 or not ':' in parts[2]:
+                continue
+            entries[parts[0]] = (parts[1], parts[2])
+        return entries
+
+    def save(self, credentials=None):
+        if credentials is not None:
+            self.update(credentials)
+
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        tmp = "%s.%d" % (self.path, os.getpid())
+        try:
+            fp = open(tmp, "w")
+            try:
+                for uri in sorted(self.entries):
+                    fp.write("%s %s %s\n" % ((uri, ) + self.entries[uri]))
+            finally:
+                fp.close()
+            os.rename(tmp, self.path)
+        except (IOError, OSError), e:
+            logger.warning("Could not write credentials snapshot '%s': %s" % (self.path, e))
@@ -0,0 +1,216 @@
+"""
+A download store that several buildouts on the same machine can share.
+
+Files are filed by the checksum in their URL's ``#md5=`` or ``#sha256=``
+fragment, and only stored once that checksum has been verified. Files
+without one are never stored, as the same URL can serve different content
+over time or to different users, while a file with a known checksum is the
+same whoever downloads it.
+"""
+
+import os
+import thread
+import shutil
+import logging
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from isotoma.buildout.basicauth.download import strip_auth
+from isotoma.buildout.basicauth.connection import get_digest, file_digest
+
+logger = logging.getLogger(__name__)
+
+class ContentStore(object):
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def get_key(self, url):
+        """The name url is stored under, or None if it shouldn't be stored"""
+        digest = get_digest(url)
+        if not digest:
+            return None
+        return os.path.join(digest[0], digest[1])
+
+    def get_path(self, url):
+        key = self.get_key(url)
+        if key is None:
+            return None
+        return os.path.join(self.directory, key)
+
+    def storable(self, url):
+        return self.get_key(url) is not None
+
+    def open(self, url):
+        """Returns the stored file for url opened for reading, or None"""
+        path = self.get_path(url)
+        if path is None or not os.path.exists(path):
+            return None
+        logger.debug("Using stored copy of %s" % strip_auth(url))
+        return open(path, 'rb')
+
+    def get(self, url, dest):
+        """
+        Puts the stored copy of url at dest, hard linking it where possible.
+        Returns False if there is no stored copy.
+        """
+        path = self.get_path(url)
+        if path is None or not os.path.exists(path):
+            return False
+
+        logger.debug("Using stored copy of %s" % strip_auth(url))
+        if os.path.exists(dest):
+            os.remove(dest)
+        try:
+            os.link(path, dest)
+        except (OSError, AttributeError):
+            shutil.copyfile(path, dest)
+        return True
+
+    def add(self, url, source):
+        """Stores the file at source as the contents of url"""
+        writer = self.writer(url)
+        if writer is None:
+            return
+        try:
+            try:
+                os.link(source, writer.tmp)
+            except (OSError, AttributeError):
+                shutil.copyfile(source, writer.tmp)
+        except (IOError, OSError), e:
+            logger.warning("Could not store %s: %s" % (strip_auth(url), e))
+            writer.abort()
+            return
+        writer.commit()
+
+    def tee(self, url, fp):
+        """Wraps fp so that whatever is read from it is stored as url"""
+        writer = self.writer(url)
+        if writer is None:
+            return fp
+        return TeeFile(fp, writer)
+
+    def writer(self, url):
+        """Returns a StoreWriter to store url with, or None"""
+        path = self.get_path(url)
+        if path is None or os.path.exists(path):
+            return None
+        return StoreWriter(url, path)
+
+
+class StoreWriter(object):
+
+    """
+    Writes a file into the store. It is written under a temporary name and
+    renamed into place under a lock once it is complete and its checksum is
+    correct, so other buildouts never see half a file or the wrong one.
+    """
+
+    def __init__(self, url, path):
+        self.url = url
+        self.path = path
+        self.tmp = "%s.%d.%d.tmp" % (path, os.getpid(), thread.get_ident())
+        self.fp = None
+
+        directory = os.path.dirname(path)
+        if not os.path.exists(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Someone else just made it
+                pass
+
+    def write(self, data):
+        if self.fp is None:
+            self.fp = open(self.tmp, 'wb')
+        self.fp.write(data)
+
+    def abort(self):
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+        if os.path.exists(self.tmp):
+            os.remove(self.tmp)
+
+    def commit(self):
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+
+        if not os.path.exists(self.tmp):
+            # Nothing was read
+            return
+
+        digest = get_digest(self.url)
+        if not digest or file_digest(self.tmp, digest[0]) != digest[1]:
+            logger.warning("Not storing %s as its %s doesn't match" % (strip_auth(self.url), digest[0]))
+            self.abort()
+            return
+
+        lock = open(self.path + '.lock', 'w')
+        try:
+            if fcntl:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            try:
+                if os.path.exists(self.path):
+                    os.remove(self.tmp)
+                else:
+                    os.rename(self.tmp, self.path)
+            finally:
+                if fcntl:
+                    fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+        finally:
+            lock.close()
+
+
+class TeeFile(object):
+
+    """
+    Passes reads through from fp, copying everything read into a StoreWriter.
+    The writer is committed once fp has been read to the end, and abandoned
+    if fp is closed before then.
+    """
+
+    def __init__(self, fp, writer):
+        self.fp = fp
+        self.writer = writer
+
+    def _seen(self, data):
+        if self.writer is None:
+            return data
+        if data:
+            self.writer.write(data)
+        else:
+            self.writer.commit()
+            self.writer = None
+        return data
+
+    def read(self, size=-1):
+        data = self._seen(self.fp.read(size))
+        if data and (size is None or size < 0):
+            self._seen('')
+        return data
+
+    def readline(self, size=-1):
+        return self._seen(self.fp.readline(size))
+
+    def readlines(self, sizehint=0):
+        return list(self)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.abort()
+            self.writer = None
+        self.fp.close()
@@ -0,0 +1,221 @@
+from unittest2 import TestCase
+import os
+import base64
+import hashlib
+import time
+import mock
+import shutil
+import socket
+import tempfile
+import threading
+import urllib2
+import BaseHTTPServer
+import SocketServer
+
+from isotoma.buildout.basicauth import connection
+from isotoma.buildout.basicauth import download
+from isotoma.buildout.basicauth.retry import RetryPolicy
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    # Send each response in one go rather than a packet per header line
+    wbufsize = -1
+
+    def do_GET(self):
+        self.server.connections.add(self.client_address)
+        self.server.auth.append(self.headers.get("Authorization"))
+        if self.path == "/missing":
+            body = "Not here"
+            self.send_response(404)
+        else:
+            body = "line one\nline two\n" + "x" * 20000
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class TestKeepAliveHandler(TestCase):
+
+    def setUp(self):
+        self.server = Server(("127.0.0.1", 0), Handler)
+        self.server.connections = set()
+        self.server.auth = []
+        t = threading.Thread(target=self.server.serve_forever, args=(0.05,))
+        t.setDaemon(True)
+        t.start()
+        self.addCleanup(self.server.shutdown)
+
+        self.url = "http://127.0.0.1:%d" % self.server.server_address[1]
+        self.handler = connection.KeepAliveHandler()
+        self.addCleanup(self.handler.pool.close)
+        self.opener = urllib2.build_opener(self.handler)
+
+    def test_reuses_connection(self):
+        for i in range(5):
+            fp = self.opener.open(self.url + "/page")
+            self.assertEqual(len(fp.read()), 20018)
+        self.assertEqual(len(self.server.connections), 1)
+
+    def test_unread_response_not_reused(self):
+        fp = self.opener.open(self.url + "/page")
+        fp.read(10)
+        fp.close()
+        self.opener.open(self.url + "/page").read()
+        self.assertEqual(len(self.server.connections), 2)
+
+    def test_readline(self):
+        fp = self.opener.open(self.url + "/page")
+        self.assertEqual(fp.readline(), "line one\n")
+        self.assertEqual(fp.readline(), "line two\n")
+        self.assertEqual(len(fp.read()), 20000)
+
+    def test_http_error(self):
+        self.assertRaises(urllib2.HTTPError, self.opener.open, self.url + "/missing")
+
+    def test_request_without_timeout(self):
+        # As built by python 2.4 and 2.5, which have no timeouts
+        req = urllib2.Request(self.url + "/page")
+        self.assertFalse(hasattr(req, "timeout"))
+        self.assertEqual(len(self.handler.http_open(req).read()), 20018)
+
+    def test_credentials_in_url(self):
+        url = self.url.replace("http://", "http://john:pass%2Fword@")
+        self.opener.open(url + "/page").read()
+        self.assertEqual(self.server.auth, ["Basic %s" % base64.b64encode("john:pass/word")])
+
+    def test_urlretrieve(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        urlretrieve = connection.make_urlretrieve(opener=self.opener)
+
+        filename, headers = urlretrieve(self.url + "/page", os.path.join(tmp, "page"))
+        self.assertEqual(os.path.getsize(filename), 20018)
+        self.assertEqual(headers["Content-Length"], "20018")
+
+        try:
+            urlretrieve(self.url + "/missing", os.path.join(tmp, "missing"))
+        except IOError, e:
+            self.assertEqual(e.args[:2], ("http error", 404))
+        else:
+            self.fail("Expected IOError")
+
+
+BIG = "".join([chr(i % 256) for i in range(100000)])
+
+
+class RangeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self.server.ranges.append(self.headers.get("Range"))
+        if self.headers.get("Range"):
+            start = int(self.headers["Range"][6:-1])
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes %d-%d/%d" % (start, len(BIG) - 1, len(BIG)))
+            self.send_header("Content-Length", str(len(BIG) - start))
+            self.end_headers()
+            self.wfile.write(BIG[start:])
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(BIG)))
+        self.end_headers()
+        if self.server.truncate:
+            self.server.truncate = False
+            self.wfile.write(BIG[:30000])
+            if self.server.stall:
+                self.wfile.flush()
+                time.sleep(self.server.stall)
+        else:
+            self.wfile.write(BIG)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestResume(TestCase):
+
+    def setUp(self):
+        self.server = Server(("127.0.0.1", 0), RangeHandler)
+        self.server.ranges = []
+        self.server.truncate = True
+        self.server.stall = 0
+        t = threading.Thread(target=self.server.serve_forever, args=(0.05,))
+        t.setDaemon(True)
+        t.start()
+        self.addCleanup(self.server.shutdown)
+        self.url = "http://127.0.0.1:%d/big.tar.gz" % self.server.server_address[1]
+
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.filename = os.path.join(self.tmp, "big.tar.gz")
+
+    def test_resume(self):
+        urlretrieve = connection.make_urlretrieve(opener=urllib2.build_opener(), resume=True)
+        self.assertRaises(IOError, urlretrieve, self.url, self.filename)
+        self.assertEqual(os.path.getsize(self.filename), 30000)
+
+        urlretrieve(self.url, self.filename)
+        self.assertEqual(open(self.filename, "rb").read(), BIG)
+        self.assertEqual(self.server.ranges, [None, "bytes=30000-"])
+
+    def test_resume_after_timeout(self):
+        self.server.stall = 1
+        timeout = socket.getdefaulttimeout()
+        socket.setdefaulttimeout(0.2)
+        self.addCleanup(socket.setdefaulttimeout, timeout)
+
+        credentials = mock.Mock()
+        credentials.search.return_value = [(None, None, False)]
+        policy = RetryPolicy(attempts=2, sleep=lambda x: None)
+        urlretrieve = connection.make_urlretrieve(opener=urllib2.build_opener(), resume=True)
+        urlretrieve = download.inject_urlretrieve_credentials(credentials, policy=policy)(urlretrieve)
+
+        urlretrieve(self.url, self.filename)
+        self.assertEqual(open(self.filename, "rb").read(), BIG)
+        # Whatever was buffered when the read timed out is fetched again
+        self.assertEqual(len(self.server.ranges), 2)
+        self.assertTrue(self.server.ranges[1].startswith("bytes="))
+
+    def test_resume_temporary_file(self):
+        urlretrieve = connection.make_urlretrieve(opener=urllib2.build_opener(), resume=True)
+        self.assertRaises(IOError, urlretrieve, self.url)
+        filename, headers = urlretrieve(self.url)
+        self.assertEqual(open(filename, "rb").read(), BIG)
+        os.remove(filename)
+
+    def test_no_resume(self):
+        urlretrieve = connection.make_urlretrieve(opener=urllib2.build_opener())
+        self.assertRaises(IOError, urlretrieve, self.url, self.filename)
+        urlretrieve(self.url, self.filename)
+        self.assertEqual(open(self.filename, "rb").read(), BIG)
+        self.assertEqual(self.server.ranges, [None, None])
+
+    def test_existing_file_not_resumed(self):
+        open(self.filename, "w").write("something else")
+        self.server.truncate = False
+        urlretrieve = connection.make_urlretrieve(opener=urllib2.build_opener(), resume=True)
+        urlretrieve(self.url, self.filename)
+        self.assertEqual(open(self.filename, "rb").read(), BIG)
+
+    def test_digest(self):
+        self.server.truncate = False
+        urlretrieve = connection.make_urlretrieve(opener=urllib2.build_opener(), resume=True)
+        urlretrieve(self.url + "#md5=" + hashlib.md5(BIG).hexdigest(), self.filename)
+        try:
+            urlretrieve(self.url + "#md5=0123", self.filename)
+        except IOError, e:
+            self.assertEqual(e.args[0], "checksum error")
+        else:
+            self.fail("Expected IOError")
+        self.assertFalse(os.path.exists(self.filename))
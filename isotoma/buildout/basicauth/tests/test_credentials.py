@@ -1,4 +1,5 @@
 from unittest2 import TestCase
+import threading
 import mock
 
 from zc.buildout import UserError
@@ -20,6 +21,17 @@ class FakeFetcherB(fetchers.Fetcher):
             yield "example2", "password", True
 
 
+class FakeFetcherC(fetchers.Fetcher):
+    name = "testc"
+    preemptive = True
+
+    def search(self, *args):
+        yield "example3", "password", True
+
+    def protected(self):
+        return ["http://private.isotoma.com/simple/"]
+
+
 class TestCredentialsMgr(TestCase):
 
     def setUp(self):
@@ -40,6 +52,7 @@ class TestCredentialsMgr(TestCase):
         self.assertEqual(self.creds.get_realm("http://www.isotoma.com/foo/bar/baz"), "http://www.isotoma.com/")
 
     def test_success(self):
+        self.creds.fetchers
         self.creds.success("http://pypi.python.org/simple/AccessControl/wibble.tar.gz", "john", "penguin55", True)
         self.assertEqual(self.creds.urls["http://pypi.python.org/"], ("john", "penguin55"))
 
@@ -49,6 +62,27 @@ class TestCredentialsMgr(TestCase):
         self.successb.assert_called_with("http://pypi.python.org/", "john", "penguin55")
         self.assertEqual(self.successb.call_count, 1)
 
+    def test_success_only_loaded_fetchers(self):
+        self.creds.get_fetcher(FakeFetcherA)
+        self.creds.success("http://pypi.python.org/simple/", "john", "penguin55", True)
+        self.assertEqual(self.successa.call_count, 1)
+        self.assertEqual(self.successb.call_count, 0)
+        self.assertEqual(self.creds.get_loaded_fetchers(), [self.creds.get_fetcher(FakeFetcherA)])
+
+    def test_fetcher_metrics(self):
+        list(self.creds.search("http://www.isotoma.com/"))
+        fetchers = self.creds.metrics.report()['fetchers']
+        self.assertEqual(sorted(fetchers.keys()), ["testa", "testb"])
+        # Only results are counted, not constructing the fetcher or the end
+        # of the search
+        self.assertEqual(fetchers["testa"]["calls"], 1)
+        self.assertEqual(fetchers["testb"]["calls"], 0)
+        self.assertTrue(fetchers["testa"]["load_seconds"] >= 0)
+
+    def test_failure(self):
+        self.creds.failure("http://www.isotoma.com/simple/foo/")
+        self.assertEqual(self.creds.denied, set(["http://www.isotoma.com/simple/foo/"]))
+
     def test_search(self):
         creds = list(self.creds.search("http://www.isotoma.com/"))
         self.assertEqual(creds, [(None, None, False), ("example1", "password", True)])
@@ -58,3 +92,240 @@ class TestCredentialsMgr(TestCase):
         creds = list(self.creds.search("http://www.isotoma.com/"))
         self.assertEqual(creds, [("john", "penguin55", False), ("example1", "password", True)])
 
+
+class TestPathPrefixes(TestCase):
+
+    def setUp(self):
+        self.creds = credentials.Credentials(mock.Mock(), ["testa"], True)
+        patcher = mock.patch.object(FakeFetcherA, "success")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_get_prefix(self):
+        self.assertEqual(self.creds.get_prefix("http://raw.github.com/isotoma/foo/master/foo.cfg"), "http://raw.github.com/isotoma/foo/master/")
+        self.assertEqual(self.creds.get_prefix("http://raw.github.com/isotoma/?q=1"), "http://raw.github.com/isotoma/")
+        self.assertEqual(self.creds.get_prefix("http://raw.github.com"), "http://raw.github.com/")
+
+    def test_success_learns_prefix(self):
+        self.creds.success("http://raw.github.com/isotoma/foo/master/foo.cfg", "andy", "penguin55", False)
+        self.assertEqual(self.creds.urls, {
+            "http://raw.github.com/isotoma/foo/master/": ("andy", "penguin55"),
+            "http://raw.github.com/": ("andy", "penguin55"),
+            })
+
+    def test_lookup_most_specific(self):
+        self.creds.success("http://raw.github.com/isotoma/foo/master/foo.cfg", "andy", "penguin55", False)
+        self.creds.success("http://raw.github.com/isotoma/bar/master/bar.cfg", "john", "sjis", False)
+
+        self.assertEqual(self.creds.lookup("http://raw.github.com/isotoma/foo/master/sub/foo.cfg"), ("andy", "penguin55"))
+        self.assertEqual(self.creds.lookup("http://raw.github.com/isotoma/bar/master/bar.cfg"), ("john", "sjis"))
+        # Anything else on the host gets whatever worked there first
+        self.assertEqual(self.creds.lookup("http://raw.github.com/isotoma/baz/master/baz.cfg"), ("andy", "penguin55"))
+        self.assertEqual(self.creds.lookup("http://www.isotoma.com/"), None)
+
+    def test_search_most_specific_first(self):
+        self.creds.success("http://raw.github.com/isotoma/foo/master/foo.cfg", "andy", "penguin55", False)
+        self.creds.success("http://raw.github.com/isotoma/bar/master/bar.cfg", "john", "sjis", False)
+        creds = list(self.creds.search("http://raw.github.com/isotoma/bar/master/other.cfg"))
+        self.assertEqual(creds, [("john", "sjis", False), ("example1", "password", True)])
+
+
+class TestPreemptive(TestCase):
+
+    def setUp(self):
+        self.creds = credentials.Credentials(mock.Mock(), ["testc"], True)
+
+    def test_protected(self):
+        self.assertEqual(self.creds.get_protected(), {"http://private.isotoma.com/": ["http://private.isotoma.com/simple/"]})
+        self.assertTrue(self.creds.is_protected("http://private.isotoma.com/simple/foo/"))
+        self.assertFalse(self.creds.is_protected("http://private.isotoma.com/public/"))
+
+    def test_search_protected(self):
+        creds = list(self.creds.search("http://private.isotoma.com/simple/foo/"))
+        self.assertEqual(creds, [("example3", "password", True), (None, None, False)])
+
+    def test_search_unprotected(self):
+        creds = list(self.creds.search("http://private.isotoma.com/public/"))
+        self.assertEqual(creds, [(None, None, False), ("example3", "password", True)])
+
+    def test_only_configured_fetchers(self):
+        patcher = mock.patch.object(fetchers.KeyringFetcher, "__init__")
+        init = patcher.start()
+        self.addCleanup(patcher.stop)
+        creds = credentials.Credentials(mock.Mock(), ["keyring", "testc"], True)
+        self.assertTrue(creds.is_protected("http://private.isotoma.com/simple/foo/"))
+        self.assertEqual(init.call_count, 0)
+
+    def test_disabled(self):
+        self.creds = credentials.Credentials(mock.Mock(), ["testc"], True, preemptive=False)
+        creds = list(self.creds.search("http://private.isotoma.com/simple/foo/"))
+        self.assertEqual(creds, [(None, None, False), ("example3", "password", True)])
+
+
+class TestRealmCache(TestCase):
+
+    def setUp(self):
+        self.cache = mock.Mock()
+        self.cache.get.return_value = None
+        self.creds = credentials.Credentials(mock.Mock(), ["testa", "testc"], True, cache=self.cache)
+
+    def test_search_uncached(self):
+        creds = list(self.creds.search("http://www.isotoma.com/"))
+        self.assertEqual(creds, [(None, None, False), ("example1", "password", True), ("example3", "password", True)])
+
+    def test_search_cached(self):
+        self.cache.get.return_value = "testc"
+        creds = list(self.creds.search("http://www.isotoma.com/"))
+        self.assertEqual(creds, [("example3", "password", True), ("example1", "password", True), (None, None, False)])
+
+    def test_success_records_fetcher(self):
+        list(self.creds.search("http://www.isotoma.com/foo"))
+        self.creds.success("http://www.isotoma.com/foo", "example3", "password", True)
+        self.cache.set.assert_called_with("http://www.isotoma.com/", "testc")
+
+    def test_success_anonymous(self):
+        list(self.creds.search("http://www.isotoma.com/foo"))
+        self.creds.success("http://www.isotoma.com/foo", None, None, False)
+        self.assertEqual(self.cache.set.call_count, 0)
+
+
+class TestSingleFlight(TestCase):
+
+    def setUp(self):
+        self.creds = credentials.Credentials(mock.Mock(), ["testa"], True)
+        patcher = mock.patch.object(FakeFetcherA, "success")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_waits_for_resolving_thread(self):
+        self.assertTrue(self.creds.claim("http://www.isotoma.com/"))
+        first = self.creds.search("http://www.isotoma.com/a")
+        self.assertEqual(first.next(), (None, None, False))
+        self.assertEqual(first.next(), ("example1", "password", True))
+
+        seen = []
+        def other():
+            self.creds.claim("http://www.isotoma.com/")
+            seen.append(self.creds.search("http://www.isotoma.com/b").next())
+        t = threading.Thread(target=other)
+        t.start()
+        t.join(0.1)
+        self.assertTrue(t.isAlive())
+        self.assertEqual(seen, [])
+
+        self.creds.success("http://www.isotoma.com/a", "example1", "password", True)
+        t.join(5)
+        self.assertEqual(seen, [("example1", "password", False)])
+
+    def test_failed_resolution_hands_over(self):
+        self.assertTrue(self.creds.claim("http://www.isotoma.com/"))
+        self.creds.search("http://www.isotoma.com/a").next()
+
+        seen = []
+        def other():
+            seen.append(self.creds.claim("http://www.isotoma.com/"))
+            seen.append(self.creds.search("http://www.isotoma.com/b").next())
+        t = threading.Thread(target=other)
+        t.start()
+        t.join(0.1)
+        self.assertEqual(seen, [])
+
+        self.creds.release("http://www.isotoma.com/")
+        t.join(5)
+        self.assertEqual(seen, [True, (None, None, False)])
+
+    def test_reentrant(self):
+        self.assertTrue(self.creds.claim("http://www.isotoma.com/"))
+        self.creds.search("http://www.isotoma.com/a").next()
+        self.assertFalse(self.creds.claim("http://www.isotoma.com/"))
+        second = self.creds.search("http://www.isotoma.com/b")
+        self.assertEqual(second.next(), (None, None, False))
+
+
+class TestNegativeCache(TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        self.creds = credentials.Credentials(mock.Mock(), ["testa"], True, deny_ttl=60, clock=lambda: self.now)
+
+    def test_fails_fast(self):
+        self.creds.failure("http://www.isotoma.com/simple/foo/")
+        self.assertEqual(list(self.creds.search("http://www.isotoma.com/simple/bar/")), [(None, None, False)])
+        self.assertEqual(self.creds.denied, set(["http://www.isotoma.com/simple/foo/"]))
+
+    def test_public_paths_tried(self):
+        self.creds.failure("http://www.isotoma.com/private/foo.tgz")
+        creds = list(self.creds.search("http://www.isotoma.com/public/bar.tgz"))
+        self.assertEqual(creds, [(None, None, False)])
+
+    def test_anonymous_pages_ignored(self):
+        self.creds.success("http://www.isotoma.com/public/", None, None, False)
+        self.creds.failure("http://www.isotoma.com/simple/foo/")
+        self.assertTrue(self.creds.is_unauthenticated("http://www.isotoma.com/simple/bar/"))
+
+    def test_known_credentials_still_tried(self):
+        self.creds.success("http://www.isotoma.com/a/", "andy", "penguin55", False)
+        self.creds.urls["http://www.isotoma.com/"] = (None, None)
+        self.creds.failure("http://www.isotoma.com/b/foo.tgz")
+        creds = list(self.creds.search("http://www.isotoma.com/a/bar.tgz"))
+        self.assertEqual(creds, [("andy", "penguin55", False), (None, None, False)])
+
+    def test_other_realms(self):
+        self.creds.failure("http://www.isotoma.com/simple/foo/")
+        creds = list(self.creds.search("http://pypi.python.org/simple/bar/"))
+        self.assertEqual(creds, [(None, None, False), ("example1", "password", True)])
+
+    def test_expires(self):
+        self.creds.failure("http://www.isotoma.com/simple/foo/")
+        self.now += 61
+        creds = list(self.creds.search("http://www.isotoma.com/simple/bar/"))
+        self.assertEqual(creds, [(None, None, False), ("example1", "password", True)])
+
+    def test_not_extended(self):
+        self.creds.failure("http://www.isotoma.com/simple/foo/")
+        self.now += 30
+        self.creds.failure("http://www.isotoma.com/simple/foo/")
+        self.now += 31
+        self.assertFalse(self.creds.is_unauthenticated("http://www.isotoma.com/simple/foo/"))
+
+    def test_realm_that_worked(self):
+        self.creds.urls["http://www.isotoma.com/"] = ("andy", "penguin55")
+        self.creds.failure("http://www.isotoma.com/simple/foo/")
+        self.assertFalse(self.creds.is_unauthenticated("http://www.isotoma.com/simple/foo/"))
+
+    def test_disabled(self):
+        self.creds.deny_ttl = 0
+        self.creds.failure("http://www.isotoma.com/simple/foo/")
+        self.assertFalse(self.creds.is_unauthenticated("http://www.isotoma.com/simple/foo/"))
+
+    def test_disabled_by_default(self):
+        creds = credentials.Credentials(mock.Mock(), ["testa"], True)
+        creds.failure("http://www.isotoma.com/simple/foo/")
+        self.assertFalse(creds.is_unauthenticated("http://www.isotoma.com/simple/foo/"))
+
+
+class TestLazyFetchers(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(FakeFetcherC, "__init__")
+        self.init = patcher.start()
+        self.init.return_value = None
+        self.addCleanup(patcher.stop)
+
+    def test_not_constructed_up_front(self):
+        creds = credentials.Credentials(mock.Mock(), ["testa", "testc"], True, preemptive=False)
+        self.assertEqual(self.init.call_count, 0)
+
+        search = creds.search("http://www.isotoma.com/")
+        self.assertEqual(search.next(), (None, None, False))
+        self.assertEqual(search.next(), ("example1", "password", True))
+        self.assertEqual(self.init.call_count, 0)
+
+        self.assertEqual(search.next(), ("example3", "password", True))
+        self.assertEqual(self.init.call_count, 1)
+
+        list(creds.search("http://www.isotoma.com/"))
+        self.assertEqual(self.init.call_count, 1)
+
+    def test_unknown_fetcher(self):
+        self.assertRaises(UserError, credentials.Credentials, mock.Mock(), ["testa", "wibble"], True)
@@ -0,0 +1,84 @@
+from unittest2 import TestCase
+import os
+import shutil
+import hashlib
+import tempfile
+
+from isotoma.buildout.basicauth import extends
+from isotoma.buildout.basicauth.batch import BatchFetcher
+
+
+class TestResolve(TestCase):
+
+    def test_url(self):
+        self.assertEqual(extends.resolve("/srv/buildout.cfg", "https://raw.github.com/isotoma/base.cfg"), "https://raw.github.com/isotoma/base.cfg")
+
+    def test_relative_to_url(self):
+        self.assertEqual(extends.resolve("https://raw.github.com/isotoma/base.cfg", "versions.cfg"), "https://raw.github.com/isotoma/versions.cfg")
+        self.assertEqual(extends.resolve("https://raw.github.com/isotoma/base.cfg", "../other/versions.cfg"), "https://raw.github.com/isotoma/../other/versions.cfg")
+
+    def test_relative_to_file(self):
+        self.assertEqual(extends.resolve("/srv/buildout.cfg", "base.cfg"), "/srv/base.cfg")
+
+    def test_cache_name(self):
+        url = "https://raw.github.com/isotoma/base.cfg"
+        self.assertEqual(extends.cache_name(url), hashlib.md5(url).hexdigest())
+
+
+class TestPrefetchExtends(TestCase):
+
+    CONFIGS = {
+        "http://www.isotoma.com/cfg/a.cfg": "[buildout]\nextends = b.cfg\n    sub/c.cfg\n",
+        "http://www.isotoma.com/cfg/b.cfg": "[buildout]\nextends = d.cfg\n",
+        "http://www.isotoma.com/cfg/sub/c.cfg": "[buildout]\nextends = http://www.isotoma.com/cfg/d.cfg\n",
+        "http://www.isotoma.com/cfg/d.cfg": "[buildout]\nparts =\n",
+        }
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.dest = os.path.join(self.tmp, "cache")
+        os.mkdir(self.dest)
+
+        self.root = os.path.join(self.tmp, "buildout.cfg")
+        open(self.root, "w").write("[buildout]\nextends = http://www.isotoma.com/cfg/a.cfg\n")
+
+        self.fetched = []
+        self.levels = []
+
+        configs = self.CONFIGS
+        fetched = self.fetched
+        class Fetcher(BatchFetcher):
+            def fetch_many(fetcher, items):
+                self.levels.append(sorted([url for url, filename in items]))
+                return BatchFetcher.fetch_many(fetcher, items)
+
+        def retrieve(url, filename):
+            fetched.append(url)
+            if not url in configs:
+                raise IOError("http error", 404)
+            open(filename, "w").write(configs[url])
+            return filename, {}
+
+        self.fetcher = Fetcher(retrieve)
+
+    def test_prefetch(self):
+        files = extends.prefetch_extends([self.root], self.dest, self.fetcher)
+
+        self.assertEqual(sorted(files.keys()), sorted(self.CONFIGS.keys()))
+        for url, path in files.items():
+            self.assertEqual(path, os.path.join(self.dest, hashlib.md5(url).hexdigest()))
+            self.assertEqual(open(path).read(), self.CONFIGS[url])
+
+        self.assertEqual(sorted(self.fetched), sorted(self.CONFIGS.keys()))
+        self.assertEqual(self.levels, [
+            ["http://www.isotoma.com/cfg/a.cfg"],
+            ["http://www.isotoma.com/cfg/b.cfg", "http://www.isotoma.com/cfg/sub/c.cfg"],
+            ["http://www.isotoma.com/cfg/d.cfg"],
+            ])
+
+    def test_missing(self):
+        open(self.root, "w").write("[buildout]\nextends = http://www.isotoma.com/cfg/missing.cfg\n    http://www.isotoma.com/cfg/d.cfg\n")
+        files = extends.prefetch_extends([self.root], self.dest, self.fetcher)
+        self.assertEqual(files.keys(), ["http://www.isotoma.com/cfg/d.cfg"])
+        self.assertEqual(sorted(os.listdir(self.dest)), [hashlib.md5("http://www.isotoma.com/cfg/d.cfg").hexdigest()])
@@ -13,6 +13,14 @@ class TestKeyring(TestCase):
         self.keyring = patcher.start()
         self.addCleanup(patcher.stop)
 
+        patcher = mock.patch("isotoma.buildout.basicauth.fetchers.atexit")
+        self.atexit = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch.multiple(fetchers, _queued=[], _flush_registered=False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
         self.backend = mock.Mock()
         self.keyring.core.load_keyring.return_value = self.backend
 
@@ -26,8 +34,40 @@ class TestKeyring(TestCase):
     def test_success(self):
         fetcher = self.setup_keyring()
         fetcher.success("http://www.isotoma.com", "andy", "penguin55")
+        fetcher.flush()
         self.keyring.set_password.assert_called_with("isotoma.buildout.basicauth", "http://www.isotoma.com", "andy:|penguin55")
 
+    def test_success_deferred(self):
+        fetcher = self.setup_keyring()
+        fetcher.success("http://www.isotoma.com", "andy", "penguin55")
+        fetcher.success("http://www.isotoma.com", "john", "sjis")
+        fetcher.success("http://github.com", "andy", "penguin55")
+        self.assertEqual(self.keyring.set_password.call_count, 0)
+
+        fetcher.flush()
+        self.assertEqual(self.keyring.set_password.call_args_list, [
+            mock.call("isotoma.buildout.basicauth", "http://github.com", "andy:|penguin55"),
+            mock.call("isotoma.buildout.basicauth", "http://www.isotoma.com", "john:|sjis"),
+            ])
+
+        fetcher.flush()
+        self.assertEqual(self.keyring.set_password.call_count, 2)
+
+    def test_flush_registered_once(self):
+        fetcher = self.setup_keyring()
+        fetcher.success("http://www.isotoma.com", "andy", "penguin55")
+        fetchers.flush_keyrings()
+        fetcher.success("http://github.com", "andy", "penguin55")
+        fetchers.KeyringFetcher(mock.Mock()).success("http://github.com", "john", "sjis")
+        self.atexit.register.assert_called_once_with(fetchers.flush_keyrings)
+
+        fetchers.flush_keyrings()
+        self.assertEqual(self.keyring.set_password.call_args_list, [
+            mock.call("isotoma.buildout.basicauth", "http://www.isotoma.com", "andy:|penguin55"),
+            mock.call("isotoma.buildout.basicauth", "http://github.com", "andy:|penguin55"),
+            mock.call("isotoma.buildout.basicauth", "http://github.com", "john:|sjis"),
+            ])
+
     def test_search_match(self):
         fetcher = self.setup_keyring("john", "sjis")
         matches = list(fetcher.search("http://githib.com/isotoma", "http://github.com"))
@@ -39,6 +79,37 @@ class TestKeyring(TestCase):
         matches = list(fetcher.search("http://github.com/isotoma", "http://github.com"))
         self.failUnlessEqual(len(matches), 0)
 
+    def test_search_memoized(self):
+        fetcher = self.setup_keyring("john", "sjis")
+        list(fetcher.search("http://github.com/isotoma", "http://github.com"))
+        matches = list(fetcher.search("http://github.com/isotoma/foo", "http://github.com"))
+        self.assertEqual(matches, [("john", "sjis", True)])
+        self.assertEqual(self.keyring.get_password.call_count, 1)
+
+    def test_search_memoized_miss(self):
+        fetcher = self.setup_keyring()
+        list(fetcher.search("http://github.com/isotoma", "http://github.com"))
+        list(fetcher.search("http://github.com/isotoma/foo", "http://github.com"))
+        self.assertEqual(self.keyring.get_password.call_count, 1)
+
+    def test_search_after_success(self):
+        fetcher = self.setup_keyring("john", "sjis")
+        list(fetcher.search("http://github.com/isotoma", "http://github.com"))
+        fetcher.success("http://github.com", "andy", "penguin55")
+        matches = list(fetcher.search("http://github.com/isotoma", "http://github.com"))
+        self.assertEqual(matches, [("andy", "penguin55", True)])
+        self.assertEqual(self.keyring.get_password.call_count, 1)
+
+    def test_not_installed(self):
+        patcher = mock.patch("isotoma.buildout.basicauth.fetchers.get_keyring")
+        get_keyring = patcher.start()
+        self.addCleanup(patcher.stop)
+        get_keyring.return_value = None
+
+        fetcher = fetchers.KeyringFetcher(mock.Mock())
+        fetcher.success("http://www.isotoma.com", "andy", "penguin55")
+        self.assertEqual(list(fetcher.search("http://github.com/isotoma", "http://github.com")), [])
+
 
 class TestPromptFetcher(TestCase):
 
@@ -118,6 +189,11 @@ class TestLovely(TestCase):
         self.assertEqual(len(matches), 1)
         self.assertEqual(matches[0], ("john", "password", True))
 
+    def test_protected(self):
+        self.assertEqual(self.fetcher.protected(), [])
+        self.part.update(dict(uri="http://www.isotoma.com", username="john", password="password"))
+        self.assertEqual(self.fetcher.protected(), ["http://www.isotoma.com"])
+
 
 def FakeOption(**kwargs):
     actual = {}
@@ -194,6 +270,10 @@ class TestBuildout(TestCase):
         self.assertEqual(len(matches), 1)
         self.assertEqual(matches[0], ("john", "password", True))
 
+    def test_protected(self):
+        self.fetcher = fetchers.BuildoutFetcher(self.mgr)
+        self.assertEqual(self.fetcher.protected(), ["http://www.isotoma.com"])
+
 
 class TestPyPiRCFetcher(TestCase):
 
@@ -207,9 +287,11 @@ class TestPyPiRCFetcher(TestCase):
         self.open = patcher.start()
         self.addCleanup(patcher.stop)
 
+    def fetcher(self):
+        return fetchers.PyPiRCFetcher(mock.Mock())
+
     def search(self, uri="http://foo.local/"):
-        f = fetchers.PyPiRCFetcher(mock.Mock())
-        return list(f.search(uri, uri))
+        return list(self.fetcher().search(uri, uri))
 
     def test_no_rc(self):
         self.assertEqual(len(self.search()), 0)
@@ -254,6 +336,8 @@ class TestPyPiRCFetcher(TestCase):
         self.assertEqual(len(matches), 1)
         self.assertEqual(matches[0], ("server", "password", True))
 
+        self.assertEqual(self.fetcher().protected(), ["http://server.local/", "http://apple.local/", "http://orange.local/"])
+
     def test_basicauth_credentials_override_distutils_servers(self):
         self.exists.return_value = True
         self.open.side_effect = lambda x: StringIO.StringIO(
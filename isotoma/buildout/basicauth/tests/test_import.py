@@ -0,0 +1,38 @@
+from unittest2 import TestCase
+import sys
+import subprocess
+
+
+SCRIPT = """
+import sys
+from isotoma.buildout.basicauth import install
+for name in sys.modules.keys():
+    print name
+"""
+
+
+class TestImport(TestCase):
+
+    # Importing the entry point happens on every buildout run, so it must
+    # not pull these in
+    DEFERRED = (
+        "keyring",
+        "ConfigParser",
+        "missingbits",
+        "urllib2",
+        "setuptools",
+        "setuptools.package_index",
+        "isotoma.buildout.basicauth.fetchers",
+        "isotoma.buildout.basicauth.download",
+        )
+
+    def test_deferred_modules(self):
+        # A fresh interpreter, as the other tests will have imported these
+        p = subprocess.Popen([sys.executable, "-c", SCRIPT], stdout=subprocess.PIPE)
+        out, err = p.communicate()
+        self.assertEqual(p.returncode, 0)
+
+        modules = out.split()
+        self.assertTrue("isotoma.buildout.basicauth" in modules)
+        for name in self.DEFERRED:
+            self.assertFalse(name in modules, "'%s' was imported" % name)
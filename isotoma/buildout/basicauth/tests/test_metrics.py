@@ -0,0 +1,63 @@
+from unittest2 import TestCase
+import os
+import json
+import shutil
+import tempfile
+
+from isotoma.buildout.basicauth.metrics import Metrics
+
+
+class TestMetrics(TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+
+    def test_request(self):
+        self.metrics.request("http://www.isotoma.com/", 0.02, 100)
+        self.metrics.request("http://www.isotoma.com/", 0.2, 50)
+        self.metrics.request("http://www.isotoma.com/", 60)
+
+        stats = self.metrics.report()['realms']['http://www.isotoma.com/']
+        self.assertEqual(stats['requests'], 3)
+        self.assertEqual(stats['bytes'], 150)
+        self.assertEqual(stats['max_seconds'], 60)
+        self.assertEqual(stats['latency']['0.05'], 1)
+        self.assertEqual(stats['latency']['0.25'], 1)
+        self.assertEqual(stats['latency']['inf'], 1)
+        self.assertEqual(stats['latency']['0.01'], 0)
+
+    def test_status_and_retries(self):
+        self.metrics.status("http://www.isotoma.com/", 401)
+        self.metrics.status("http://www.isotoma.com/", 401)
+        self.metrics.status("http://www.isotoma.com/", 404)
+        self.metrics.retry("http://www.isotoma.com/", 1.5)
+
+        stats = self.metrics.report()['realms']['http://www.isotoma.com/']
+        self.assertEqual(stats['status'], {'401': 2, '404': 1})
+        self.assertEqual(stats['retries'], 1)
+        self.assertEqual(stats['retry_sleep'], 1.5)
+
+    def test_fetcher(self):
+        self.metrics.fetcher_loaded("keyring", 0.125)
+        self.metrics.fetcher("keyring", 0.5)
+        self.metrics.fetcher("keyring", 0.25, 0)
+        self.assertEqual(self.metrics.report()['fetchers'], {'keyring': {'calls': 1, 'seconds': 0.75, 'load_seconds': 0.125}})
+
+    def test_summary(self):
+        self.metrics.request("http://www.isotoma.com/", 0.02, 100)
+        self.metrics.status("http://www.isotoma.com/", 403)
+        self.metrics.fetcher("prompt", 3)
+
+        lines = self.metrics.summary()
+        self.assertTrue(lines[0].startswith("realm"))
+        self.assertEqual(lines[1].split(), ["http://www.isotoma.com/", "1", "100", "20.0", "20.0", "0", "1", "0", "0", "0.0"])
+        self.assertEqual(lines[-1].split(), ["prompt", "1", "3.000", "0.000"])
+
+    def test_write(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        path = os.path.join(tmp, "metrics.json")
+
+        self.metrics.request("http://www.isotoma.com/", 0.02, 100)
+        self.metrics.write(path)
+        self.assertEqual(json.load(open(path)), json.loads(json.dumps(self.metrics.report())))
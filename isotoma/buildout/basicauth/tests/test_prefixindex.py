@@ -0,0 +1,57 @@
+from unittest2 import TestCase
+
+from isotoma.buildout.basicauth.prefixindex import PrefixIndex
+
+
+PREFIXES = [
+    "http://www.isotoma.com",
+    "http://www.isotoma.com/",
+    "http://www.isotoma.com/simple/",
+    "http://www.isotoma.com/simple/foo",
+    "http://www.isotoma.com/sim",
+    "https://www.isotoma.com/",
+    "http://www.isotoma.co",
+    "http://",
+    "",
+    ]
+
+URIS = [
+    "http://www.isotoma.com",
+    "http://www.isotoma.com/",
+    "http://www.isotoma.com/simple/foo/",
+    "http://www.isotoma.com/simple/foobar",
+    "http://www.isotoma.com/similar",
+    "http://www.isotoma.co.uk/",
+    "https://www.isotoma.com/simple/",
+    "ftp://www.isotoma.com/",
+    ]
+
+
+class TestPrefixIndex(TestCase):
+
+    def setUp(self):
+        self.index = PrefixIndex([(p, p) for p in PREFIXES])
+
+    def test_matches_startswith(self):
+        for uri in URIS:
+            expected = sorted([p for p in PREFIXES if uri.startswith(p)])
+            self.assertEqual(sorted(self.index.search(uri)), expected)
+
+    def test_most_specific_first(self):
+        self.assertEqual(self.index.search("http://www.isotoma.com/simple/foo/"), [
+            "http://www.isotoma.com/simple/foo",
+            "http://www.isotoma.com/simple/",
+            "http://www.isotoma.com/sim",
+            "http://www.isotoma.com/",
+            "http://www.isotoma.com",
+            "http://www.isotoma.co",
+            "http://",
+            "",
+            ])
+
+    def test_duplicates_keep_order(self):
+        index = PrefixIndex([("http://a/", 1), ("http://a/", 2)])
+        self.assertEqual(index.search("http://a/b"), [1, 2])
+
+    def test_empty(self):
+        self.assertEqual(PrefixIndex().search("http://www.isotoma.com/"), [])
@@ -0,0 +1,168 @@
+from unittest2 import TestCase
+import os
+import shutil
+import tempfile
+import threading
+import time
+import mock
+import pkg_resources
+
+from isotoma.buildout.basicauth import protected_ext
+from isotoma.buildout.basicauth import threadpool
+
+
+class TestThreadPool(TestCase):
+
+    def test_results_in_order(self):
+        results = threadpool.run(lambda x: x * 2, range(10), 3)
+        self.assertEqual(results, [(True, x * 2) for x in range(10)])
+
+    def test_exceptions(self):
+        def func(x):
+            if x == 1:
+                raise ValueError(x)
+            return x
+        results = threadpool.run(func, range(3), 2)
+        self.assertEqual(results[0], (True, 0))
+        self.assertEqual(results[1][0], False)
+        self.assertTrue(isinstance(results[1][1], ValueError))
+        self.assertEqual(results[2], (True, 2))
+
+    def test_bounded(self):
+        lock = threading.Lock()
+        state = {"running": 0, "peak": 0}
+        def func(x):
+            lock.acquire()
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+            lock.release()
+            time.sleep(0.01)
+            lock.acquire()
+            state["running"] -= 1
+            lock.release()
+        threadpool.run(func, range(20), 4)
+        self.assertEqual(state["peak"], 4)
+
+    def test_empty(self):
+        self.assertEqual(threadpool.run(lambda x: x, [], 4), [])
+
+
+class TestPrefetch(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch("setuptools.package_index.PackageIndex")
+        self.index = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_prefetch(self):
+        protected_ext.prefetch(["a", "b", "c"], "/tmp/x", ["http://links/"], "http://index/", 2)
+        self.assertEqual(self.index.call_count, 3)
+        self.index.assert_called_with("http://index/", hosts=('*',))
+        fetched = sorted([c[0][0].project_name for c in self.index.return_value.fetch_distribution.call_args_list])
+        self.assertEqual(fetched, ["a", "b", "c"])
+
+    def test_prefetch_failure(self):
+        self.index.return_value.fetch_distribution.side_effect = IOError("boom")
+        protected_ext.prefetch(["a", "b"], "/tmp/x", [], None, 2)
+        self.index.assert_called_with(hosts=('*',))
+
+
+class Buildout(dict):
+
+    newest = True
+    _allow_hosts = ('*',)
+
+
+class TestLoadProtectedExtensions(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.eggs = os.path.join(self.tmp, "eggs")
+        os.mkdir(self.eggs)
+
+        patcher = mock.patch("setuptools.package_index.PackageIndex")
+        self.index = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch("zc.buildout.easy_install.install")
+        self.install = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.buildout = Buildout()
+        self.buildout['buildout'] = {
+            'develop-eggs-directory': os.path.join(self.tmp, "develop-eggs"),
+            'eggs-directory': self.eggs,
+            'offline': 'false',
+            }
+        self.buildout['basicauth'] = {'prefetch-workers': '4'}
+
+    def load(self, specs):
+        self.buildout['buildout']['protected-extensions'] = "\n".join(specs)
+        protected_ext.load_protected_extensions(self.buildout)
+        fetched = [c[0][0].project_name for c in self.index.return_value.fetch_distribution.call_args_list]
+        self.assertEqual(self.install.call_count, 1)
+        return sorted(fetched)
+
+    def add_egg(self, name, version):
+        egg_info = os.path.join(self.eggs, "%s-%s-py%s.egg" % (name, version, pkg_resources.PY_MAJOR), "EGG-INFO")
+        os.makedirs(egg_info)
+        open(os.path.join(egg_info, "PKG-INFO"), "w").close()
+
+    def test_prefetch(self):
+        self.assertEqual(self.load(["wibble", "wobble"]), ["wibble", "wobble"])
+
+    def test_installed_not_fetched(self):
+        self.assertEqual(self.load(["setuptools", "mock"]), [])
+
+    def test_eggs_directory(self):
+        self.add_egg("wibble", "1.0")
+        self.buildout.newest = False
+        self.assertEqual(self.load(["wibble", "wobble", "wubble"]), ["wobble", "wubble"])
+
+    def test_eggs_directory_newest(self):
+        self.add_egg("wibble", "1.0")
+        self.assertEqual(self.load(["wibble", "wobble"]), ["wibble", "wobble"])
+
+    def test_eggs_directory_pinned(self):
+        self.add_egg("wibble", "1.0")
+        self.assertEqual(self.load(["wibble==1.0", "wobble", "wubble"]), ["wobble", "wubble"])
+
+
+class TestForgetUrls(TestCase):
+
+    def setUp(self):
+        self.index = mock.Mock()
+        self.index.scanned_urls = {"http://private/simple/": True, "http://public/simple/": True}
+        self.index.fetched_urls = {"http://private/simple/": True, "http://public/simple/": True}
+
+        patcher = mock.patch("zc.buildout.easy_install._indexes", {("http://private/simple/", ()): self.index})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_forget_pages_read_before_install(self):
+        def install(*args, **kwargs):
+            self.index.fetched_urls["http://private/simple/foo/"] = True
+        patcher = mock.patch("zc.buildout.easy_install.install", side_effect=install)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        buildout = Buildout()
+        buildout['buildout'] = {
+            'protected-extensions': 'foo',
+            'develop-eggs-directory': '/tmp/develop-eggs',
+            'eggs-directory': '/tmp/eggs',
+            'offline': 'true',
+            }
+        buildout['basicauth'] = {}
+        credentials = mock.Mock()
+        credentials.denied = set()
+
+        protected_ext.load_protected_extensions(buildout, credentials)
+        self.assertEqual(self.index.fetched_urls, {"http://private/simple/foo/": True})
+        self.assertEqual(self.index.scanned_urls, {})
+
+    def test_forget(self):
+        protected_ext.forget_urls(set(["http://private/simple/"]))
+        self.assertEqual(self.index.scanned_urls, {"http://public/simple/": True})
+        self.assertEqual(self.index.fetched_urls, {"http://public/simple/": True})
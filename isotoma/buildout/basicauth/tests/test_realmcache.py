@@ -0,0 +1,38 @@
+from unittest2 import TestCase
+import os
+import shutil
+import tempfile
+
+from isotoma.buildout.basicauth.realmcache import RealmCache
+
+
+class TestRealmCache(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.path = os.path.join(self.tmp, "cache", "basicauth-realms")
+
+    def test_missing_file(self):
+        cache = RealmCache(self.path)
+        self.assertEqual(cache.get("http://www.isotoma.com/"), None)
+
+    def test_roundtrip(self):
+        cache = RealmCache(self.path)
+        cache.set("http://www.isotoma.com/", "buildout")
+        cache.set("https://raw.github.com/", "keyring")
+
+        cache = RealmCache(self.path)
+        self.assertEqual(cache.get("http://www.isotoma.com/"), "buildout")
+        self.assertEqual(cache.get("https://raw.github.com/"), "keyring")
+
+    def test_no_secrets(self):
+        cache = RealmCache(self.path)
+        cache.set("http://www.isotoma.com/", "buildout")
+        self.assertEqual(open(self.path).read(), "http://www.isotoma.com/ buildout\n")
+
+    def test_ignores_junk(self):
+        os.makedirs(os.path.dirname(self.path))
+        open(self.path, "w").write("junk\nhttp://www.isotoma.com/ pypi\n")
+        cache = RealmCache(self.path)
+        self.assertEqual(cache.realms, {"http://www.isotoma.com/": "pypi"})
@@ -0,0 +1,106 @@
+from unittest2 import TestCase
+import socket
+import mock
+import urllib2
+import mimetools
+import StringIO
+
+from isotoma.buildout.basicauth import retry
+
+
+def http_error(code, **headers):
+    hdrs = mimetools.Message(StringIO.StringIO(
+        "".join(["%s: %s\n" % (k, v) for k, v in headers.items()])))
+    return urllib2.HTTPError("http://www.isotoma.com/", code, "Error", hdrs, StringIO.StringIO(""))
+
+
+class TestRetryPolicy(TestCase):
+
+    def setUp(self):
+        self.slept = []
+        self.policy = retry.RetryPolicy(
+            attempts = 5,
+            base_delay = 1.0,
+            max_delay = 10.0,
+            sleep = self.slept.append,
+            random = lambda: 1.0,
+            clock = lambda: 1000000000.0,
+            )
+
+    def test_backoff(self):
+        delays = [self.policy.delay(i) for i in range(6)]
+        self.assertEqual(delays, [1.0, 2.0, 4.0, 8.0, 10.0, 10.0])
+
+    def test_jitter(self):
+        self.policy.random = lambda: 0.25
+        self.assertEqual(self.policy.delay(2), 1.0)
+
+    def test_retryable(self):
+        self.assertTrue(self.policy.retryable(socket.timeout()))
+        self.assertTrue(self.policy.retryable(socket.error(104, "Connection reset by peer")))
+        self.assertTrue(self.policy.retryable(urllib2.URLError("refused")))
+        self.assertTrue(self.policy.retryable(http_error(503)))
+        self.assertTrue(self.policy.retryable(IOError('http error', 502, 'Bad Gateway', {})))
+        self.assertTrue(self.policy.retryable(IOError('socket error', socket.error(104))))
+
+        self.assertTrue(self.policy.retryable(retry.ContentTooShortError("retrieval incomplete", None)))
+
+        self.assertFalse(self.policy.retryable(http_error(400)))
+        self.assertFalse(self.policy.retryable(ValueError()))
+        self.assertFalse(self.policy.retryable(IOError(28, 'No space left on device')))
+
+    def test_retryable_without_content_too_short(self):
+        # As on python 2.4, where urllib doesn't have it
+        patcher = mock.patch.object(retry, "ContentTooShortError", retry._ContentTooShortError)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.assertTrue(self.policy.retryable(retry._ContentTooShortError("retrieval incomplete", None)))
+        self.assertFalse(self.policy.retryable(ValueError()))
+
+    def test_retry_after_seconds(self):
+        self.policy.random = lambda: 0.0
+        self.assertEqual(self.policy.delay(0, http_error(503, **{"Retry-After": "7"})), 7.0)
+        self.assertEqual(self.policy.delay(0, http_error(429, **{"Retry-After": "120"})), 120.0)
+
+    def test_retry_after_date(self):
+        self.assertEqual(self.policy.delay(0, http_error(503, **{"Retry-After": "Sun, 09 Sep 2001 01:47:00 GMT"})), 20.0)
+
+    def test_retry_after_ignored(self):
+        self.assertEqual(self.policy.delay(0, http_error(500, **{"Retry-After": "120"})), 1.0)
+        self.assertEqual(self.policy.delay(0, http_error(503, **{"Retry-After": "soon"})), 1.0)
+
+
+class TestCircuitBreaker(TestCase):
+
+    def setUp(self):
+        self.now = 100.0
+        self.breaker = retry.CircuitBreaker(threshold=3, cooldown=60, clock=lambda: self.now)
+
+    def test_trips(self):
+        for i in range(2):
+            self.breaker.failure("http://a/")
+            self.assertTrue(self.breaker.allow("http://a/"))
+        self.breaker.failure("http://a/")
+        self.assertFalse(self.breaker.allow("http://a/"))
+        self.assertTrue(self.breaker.allow("http://b/"))
+
+    def test_cooldown(self):
+        for i in range(3):
+            self.breaker.failure("http://a/")
+        self.now += 61
+        self.assertTrue(self.breaker.allow("http://a/"))
+        self.breaker.failure("http://a/")
+        self.assertFalse(self.breaker.allow("http://a/"))
+
+    def test_success_resets(self):
+        self.breaker.failure("http://a/")
+        self.breaker.failure("http://a/")
+        self.breaker.success("http://a/")
+        self.breaker.failure("http://a/")
+        self.assertTrue(self.breaker.allow("http://a/"))
+
+    def test_disabled(self):
+        self.breaker.threshold = 0
+        for i in range(10):
+            self.breaker.failure("http://a/")
+        self.assertTrue(self.breaker.allow("http://a/"))
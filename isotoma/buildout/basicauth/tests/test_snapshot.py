@@ -0,0 +1,75 @@
+from unittest2 import TestCase
+import os
+import shutil
+import tempfile
+import mock
+
+from isotoma.buildout.basicauth import credentials
+from isotoma.buildout.basicauth.snapshot import Snapshot
+
+
+class TestSnapshot(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.path = os.path.join(self.tmp, "snapshot", "basicauth-snapshot")
+
+        self.creds = credentials.Credentials(mock.Mock(), [], True)
+        self.creds.urls["https://pypi.example.com/"] = ("andy", "penguin55")
+        self.creds.urls["https://raw.github.com/isotoma/foo/"] = ("john", "sjis")
+        self.creds.urls["http://www.isotoma.com/"] = (None, None)
+        self.creds.sources[("https://pypi.example.com/", "andy", "penguin55")] = "keyring"
+
+        patcher = mock.patch.dict(os.environ, {
+            "BASICAUTH_PYPI_EXAMPLE_COM_USERNAME": "andy",
+            "BASICAUTH_PYPI_EXAMPLE_COM_PASSWORD": "penguin55",
+            })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_missing_file(self):
+        self.assertEqual(Snapshot(self.path).credentials(), {})
+
+    def test_save(self):
+        Snapshot(self.path).save(self.creds)
+        self.assertEqual(open(self.path).read().splitlines(), [
+            "https://pypi.example.com/ keyring env:BASICAUTH_PYPI_EXAMPLE_COM_USERNAME,BASICAUTH_PYPI_EXAMPLE_COM_PASSWORD",
+            "https://raw.github.com/isotoma/foo/ unknown env:BASICAUTH_RAW_GITHUB_COM_ISOTOMA_FOO_USERNAME,BASICAUTH_RAW_GITHUB_COM_ISOTOMA_FOO_PASSWORD",
+            ])
+        self.assertFalse("penguin55" in open(self.path).read())
+
+    def test_one_entry_per_realm(self):
+        creds = credentials.Credentials(mock.Mock(), [], True)
+        for package in ("foo", "bar", "baz"):
+            creds.success("https://pypi.example.com/simple/%s/" % package, "andy", "penguin55", False)
+        Snapshot(self.path).save(creds)
+        self.assertEqual(open(self.path).read().splitlines(), [
+            "https://pypi.example.com/ unknown env:BASICAUTH_PYPI_EXAMPLE_COM_USERNAME,BASICAUTH_PYPI_EXAMPLE_COM_PASSWORD",
+            ])
+
+    def test_roundtrip(self):
+        Snapshot(self.path).save(self.creds)
+        self.assertEqual(Snapshot(self.path).credentials(), {"https://pypi.example.com/": ("andy", "penguin55")})
+
+    def test_file_ref(self):
+        secret = os.path.join(self.tmp, "secret")
+        open(secret, "w").write("john:sj:is\n")
+        os.makedirs(os.path.dirname(self.path))
+        open(self.path, "w").write("https://raw.github.com/isotoma/foo/ buildout file:%s\n" % secret)
+        self.assertEqual(Snapshot(self.path).credentials(), {"https://raw.github.com/isotoma/foo/": ("john", "sj:is")})
+
+    def test_edited_refs_kept(self):
+        os.makedirs(os.path.dirname(self.path))
+        open(self.path, "w").write("https://raw.github.com/isotoma/foo/ buildout file:/run/secrets/github\n")
+        Snapshot(self.path).save(self.creds)
+        self.assertEqual(open(self.path).read().splitlines()[1], "https://raw.github.com/isotoma/foo/ buildout file:/run/secrets/github")
+
+    def test_seeds_credentials(self):
+        Snapshot(self.path).save(self.creds)
+        creds = credentials.Credentials(mock.Mock(), ["buildout", "pypi"], True)
+        creds.urls.update(Snapshot(self.path).credentials())
+        self.assertEqual(creds._fetchers, {})
+        search = creds.search("https://pypi.example.com/simple/foo/")
+        self.assertEqual(search.next(), ("andy", "penguin55", False))
+        self.assertEqual(creds._fetchers, {})
@@ -0,0 +1,123 @@
+from unittest2 import TestCase
+import os
+import shutil
+import hashlib
+import tempfile
+import StringIO
+import mock
+
+from isotoma.buildout.basicauth import download
+from isotoma.buildout.basicauth.store import ContentStore
+
+BODY = "pretend this is a tarball"
+MD5 = hashlib.md5(BODY).hexdigest()
+
+
+class TestContentStore(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.store = ContentStore(os.path.join(self.tmp, "store"))
+
+        self.source = os.path.join(self.tmp, "source")
+        open(self.source, "w").write(BODY)
+
+    def test_keys(self):
+        self.assertEqual(self.store.get_key("http://a/pkg-1.0.tar.gz#md5=%s" % MD5), os.path.join("md5", MD5))
+        self.assertEqual(
+            self.store.get_key("http://john:pass@a/pkg-1.0.tar.gz#md5=%s" % MD5),
+            self.store.get_key("http://a/pkg-1.0.tar.gz#md5=%s" % MD5))
+        self.assertEqual(self.store.get_key("http://a/pkg-1.0.tar.gz"), None)
+        self.assertEqual(self.store.get_key("http://a/archive/master.zip"), None)
+        self.assertEqual(self.store.get_key("http://a/simple/pkg/"), None)
+        self.assertEqual(self.store.get_key("http://a/versions.cfg"), None)
+
+    def test_add_and_get(self):
+        url = "http://a/pkg-1.0.tar.gz#md5=%s" % MD5
+        self.assertFalse(self.store.get(url, os.path.join(self.tmp, "dest")))
+
+        self.store.add(url, self.source)
+        dest = os.path.join(self.tmp, "dest")
+        open(dest, "w").write("placeholder")
+        self.assertTrue(self.store.get(url, dest))
+        self.assertEqual(open(dest).read(), BODY)
+        self.assertEqual(os.stat(dest).st_ino, os.stat(self.store.get_path(url)).st_ino)
+
+    def test_bad_checksum_not_stored(self):
+        url = "http://a/pkg-1.0.tar.gz#md5=0123"
+        self.store.add(url, self.source)
+        self.assertFalse(os.path.exists(self.store.get_path(url)))
+        self.assertEqual(os.listdir(os.path.dirname(self.store.get_path(url))), [])
+
+    def test_tee(self):
+        url = "http://a/pkg-1.0.tar.gz#md5=%s" % MD5
+        fp = self.store.tee(url, StringIO.StringIO(BODY))
+        while fp.read(4):
+            pass
+        self.assertEqual(self.store.open(url).read(), BODY)
+
+    def test_tee_closed_early(self):
+        url = "http://a/pkg-1.0.tar.gz#md5=%s" % MD5
+        fp = self.store.tee(url, StringIO.StringIO(BODY))
+        fp.read(4)
+        fp.close()
+        self.assertEqual(self.store.open(url), None)
+
+    def test_tee_not_storable(self):
+        fp = StringIO.StringIO(BODY)
+        self.assertTrue(self.store.tee("http://a/simple/", fp) is fp)
+
+
+class TestStoreAdaptors(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.store = ContentStore(self.tmp)
+
+        self.credentials = mock.Mock()
+        self.credentials.search.return_value = [(None, None, False)]
+
+    def test_distribute(self):
+        auth_func = mock.Mock()
+        auth_func.return_value = download.addinfourl(StringIO.StringIO(BODY), {}, '', 200)
+        func = download.inject_credentials(self.credentials, store=self.store)(auth_func)
+
+        url = "http://a/pkg-1.0.tar.gz#md5=%s" % MD5
+        self.assertEqual(func(url).read(), BODY)
+        resp = func(url)
+        self.assertEqual(resp.read(), BODY)
+        self.assertEqual(resp.info()["Content-Length"], str(len(BODY)))
+        self.assertEqual(auth_func.call_count, 1)
+
+    def test_urlretrieve(self):
+        def urlretrieve(url, filename=None, *args):
+            open(filename, "w").write(BODY)
+            return filename, {}
+        auth_func = mock.Mock(side_effect=urlretrieve)
+        func = download.inject_urlretrieve_credentials(self.credentials, store=self.store)(auth_func)
+
+        url = "http://a/pkg-1.0.tar.gz#md5=%s" % MD5
+        first = func(url, os.path.join(self.tmp, "first"))[0]
+        second = func(url, os.path.join(self.tmp, "second"))[0]
+        self.assertEqual(open(second).read(), BODY)
+        self.assertEqual(auth_func.call_count, 1)
+
+    def test_urlretrieve_not_storable(self):
+        auth_func = mock.Mock(return_value=("x", {}))
+        func = download.inject_urlretrieve_credentials(self.credentials, store=self.store)(auth_func)
+        func("http://a/buildout.cfg", "x")
+        func("http://a/buildout.cfg", "x")
+        self.assertEqual(auth_func.call_count, 2)
+
+    def test_distribute_no_checksum(self):
+        auth_func = mock.Mock()
+        auth_func.side_effect = lambda url: download.addinfourl(StringIO.StringIO(BODY), {}, '', 200)
+        func = download.inject_credentials(self.credentials, store=self.store)(auth_func)
+
+        url = "http://a/archive/master.zip"
+        self.assertEqual(func(url).read(), BODY)
+        self.assertEqual(func(url).read(), BODY)
+        self.assertEqual(auth_func.call_count, 2)
+        self.assertEqual(self.credentials.search.call_count, 2)
@@ -0,0 +1,39 @@
+import sys
+import threading
+import Queue
+
+
+def run(func, items, workers):
+    """
+    Calls ``func`` with each of ``items`` on at most ``workers`` threads.
+
+    Returns a list of ``(success, value)`` pairs in the same order as
+    ``items``, where value is either what ``func`` returned or the exception
+    it raised.
+    """
+    items = list(items)
+    results = [None] * len(items)
+
+    queue = Queue.Queue()
+    for i, item in enumerate(items):
+        queue.put((i, item))
+
+    def worker():
+        while True:
+            try:
+                i, item = queue.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[i] = (True, func(item))
+            except Exception:
+                results[i] = (False, sys.exc_info()[1])
+
+    threads = [threading.Thread(target=worker) for i in range(max(1, min(workers, len(items))))]
+    for t in threads:
+        t.setDaemon(True)
+        t.start()
+    for t in threads:
+        t.join()
+
+    return results